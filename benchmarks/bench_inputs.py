@@ -0,0 +1,150 @@
+#
+# Deterministic generators of synthetic inputs for the analysis tools,
+# used by run-benchmarks.py. The same seed and sizes always produce the
+# same files, so timings of different runs are comparable.
+#
+# Each generator writes a file like the ones the tools read:
+#
+#   overlay log       vulkan overlay layer output (fps-summary.py)
+#   trace samples     "trace,fps" lines of run-all-traces.py (report-fps-traces.py)
+#   failures csv      deqp-runner failures.csv (deqp-runner-check-regressions-from-csv.py)
+#   qpa               dEQP/CTS TestResults.qpa (deqp-list-*.sh, deqp-list.py)
+#
+# The before/after pairs are generated with the same seed and a
+# different "variant", that changes some of the values, so the tools
+# find some changes to report.
+#
+import os
+import random
+
+# Written in batches, so the multi-GB qpa files don't need to be in memory
+WRITE_BATCH = 1000
+
+STATUS_MIX = [('Pass', 0.85), ('NotSupported', 0.1), ('Fail', 0.04), ('QualityWarning', 0.01)]
+TERMINATE_REASONS = ['Crash', 'Timeout']
+
+def get_rng(seed, name, variant=0):
+    return random.Random(f"{seed}:{name}:{variant}")
+
+def write_atomically(path, write):
+    """Writes the file with write(file_obj), through a temporary file so
+    an interrupted generation doesn't leave a truncated input behind"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file_obj:
+        write(file_obj)
+    os.replace(tmp_path, path)
+
+def get_case_name(rng, suite, index):
+    groups = ['functional', 'stress', 'accuracy', 'performance']
+    areas = ['texture', 'shaders', 'fbo', 'draw', 'buffer', 'fragment_ops', 'rasterization']
+    return f"dEQP-{suite}.{rng.choice(groups)}.{rng.choice(areas)}.case_{index:08d}"
+
+def write_overlay_log(path, frames, seed=0, variant=0):
+    """Overlay log with frames per-frame samples (fps_sampling_period=0)"""
+    rng = get_rng(seed, 'overlay', variant)
+    base_fps = rng.uniform(30.0, 144.0)
+
+    def write(file_obj):
+        file_obj.write("fps, frame, frame_timing\n")
+        lines = []
+        for frame in range(frames):
+            fps = base_fps * rng.gauss(1.0, 0.05)
+            # Some stutters
+            if rng.random() < 0.005:
+                fps /= rng.uniform(2.0, 5.0)
+            lines.append(f"{fps:.2f}, {frame}, {int(1e9 / fps)}\n")
+            if len(lines) == WRITE_BATCH:
+                file_obj.writelines(lines)
+                lines.clear()
+        file_obj.writelines(lines)
+
+    write_atomically(path, write)
+
+def write_trace_samples(path, traces, samples, seed=0, variant=0):
+    """trace,fps lines with samples samples of each trace. The variants
+    other than 0 have 10% of the traces 5% slower or faster."""
+    rng = get_rng(seed, 'traces')
+    base_fps = [rng.uniform(10.0, 500.0) for _ in range(traces)]
+    if variant:
+        changes = get_rng(seed, 'traces', variant)
+        base_fps = [fps * changes.choice([0.95, 1.05]) if changes.random() < 0.1 else fps for fps in base_fps]
+    rng = get_rng(seed, 'trace-samples', variant)
+
+    def write(file_obj):
+        for sample in range(samples):
+            for trace, fps in enumerate(base_fps):
+                extension = '.gfxr' if trace % 2 else '.trace'
+                file_obj.write(f"trace-{trace:06d}{extension},{fps * rng.gauss(1.0, 0.01):.2f}\n")
+
+    write_atomically(path, write)
+
+def write_failures_csv(path, cases, seed=0, variant=0):
+    """deqp-runner failures.csv of a run of cases cases. The variants
+    other than 0 have 1% of the cases with another status."""
+    rng = get_rng(seed, 'failures')
+    changes = get_rng(seed, 'failures', variant)
+    statuses = ['Fail', 'Crash', 'Timeout']
+
+    def write(file_obj):
+        lines = []
+        for index in range(cases):
+            name = get_case_name(rng, 'VK', index)
+            status = rng.choices([None] + statuses, weights=[0.95, 0.04, 0.007, 0.003])[0]
+            if variant and changes.random() < 0.01:
+                status = changes.choice([None] + statuses)
+            if status is not None:
+                lines.append(f"{name},{status}\n")
+            if len(lines) == WRITE_BATCH:
+                file_obj.writelines(lines)
+                lines.clear()
+        file_obj.writelines(lines)
+
+    write_atomically(path, write)
+
+def get_qpa_case(rng, name, status, log_size):
+    if status in TERMINATE_REASONS:
+        return (f"#beginTestCaseResult {name}\n"
+                f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<TestCaseResult Version="0.3.4" CasePath="{name}" CaseType="SelfValidate">\n'
+                f"<Text>{'x' * log_size}</Text>\n"
+                f"#terminateTestCaseResult {status}\n")
+    return (f"#beginTestCaseResult {name}\n"
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<TestCaseResult Version="0.3.4" CasePath="{name}" CaseType="SelfValidate">\n'
+            f"<Text>{'x' * log_size}</Text>\n"
+            f'<Result StatusCode="{status}">{status}</Result>\n'
+            f"</TestCaseResult>\n\n"
+            f"#endTestCaseResult\n")
+
+def write_qpa(path, size, seed=0, variant=0):
+    """qpa file of about size bytes. The variants other than 0 have 1% of
+    the cases with another status. Returns the number of cases."""
+    rng = get_rng(seed, 'qpa')
+    changes = get_rng(seed, 'qpa', variant)
+    names, weights = zip(*STATUS_MIX)
+    cases = 0
+
+    def write(file_obj):
+        nonlocal cases
+        file_obj.write("#beginSession\n")
+        written = 0
+        batch = []
+        while written < size:
+            status = rng.choices(names, weights)[0]
+            if rng.random() < 0.002:
+                status = rng.choice(TERMINATE_REASONS)
+            log_size = int(rng.expovariate(1.0 / 1500))
+            if variant and changes.random() < 0.01:
+                status = changes.choice(names + tuple(TERMINATE_REASONS))
+            case = get_qpa_case(rng, get_case_name(rng, 'GLES31', cases), status, log_size)
+            batch.append(case)
+            written += len(case)
+            cases += 1
+            if len(batch) == WRITE_BATCH:
+                file_obj.writelines(batch)
+                batch.clear()
+        file_obj.writelines(batch)
+        file_obj.write("#endSession\n")
+
+    write_atomically(path, write)
+    return cases
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+#
+# Benchmarks the analysis tools (fps-summary.py, report-fps-traces.py,
+# deqp-runner-check-regressions-from-csv.py, deqp-list-*.sh and
+# deqp-list.py) with synthetic inputs at several scales, measuring the
+# throughput and the peak RSS of each tool.
+#
+# The inputs are generated by bench_inputs.py, deterministically from
+# the seed, and kept on the data directory, so they are only generated
+# once per scale. The results can be saved as a json baseline, and
+# compared against it later:
+#
+#   run-benchmarks.py --scales small,medium --save baseline.json
+#   run-benchmarks.py --scales small,medium --compare baseline.json
+#
+# The shell scripts are run with bash, as their shebang is missing.
+# Before timing them, the shell and python deqp-list tools are checked
+# to list the same cases.
+#
+# The large scales are slow to generate, and the conformance one
+# writes a qpa file of several GB (like those of a conformance run).
+#
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import bench_inputs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FPS_ANALYSIS_DIR = os.path.join(REPO_DIR, 'fps-analysis')
+DEQP_DIR = os.path.join(REPO_DIR, 'deqp')
+DEQP_LIST_DIR = os.path.join(DEQP_DIR, 'deqp-list')
+
+# The size of the inputs is multiplied by the factor of the scale
+SCALES = {
+    'small': 1,
+    'medium': 10,
+    'large': 100,
+    'conformance': 1000,
+}
+
+OVERLAY_FRAMES = 20000
+TRACES = 50
+TRACE_SAMPLES = 10
+FAILURES_CASES = 20000
+QPA_SIZE = 3 * 1024 * 1024
+
+# The shell and python versions of the deqp-list tools have to list the
+# same cases, or their timings can't be compared. Only the case names
+# are compared, as the shell regressions script gets the status of the
+# terminated cases from the case after them.
+OUTPUT_CHECKS = [
+    ('deqp-list-fail.sh', 'deqp-list.py fail'),
+    ('deqp-list-regressions.sh', 'deqp-list.py regressions'),
+]
+
+def get_inputs(data_dir, scale, seed):
+    """Generates the inputs of the scale that don't exist yet, and
+    returns a dict with their paths and number of items"""
+    factor = SCALES[scale]
+    directory = os.path.join(data_dir, f"{scale}-{seed}")
+    os.makedirs(directory, exist_ok=True)
+
+    inputs = {}
+    def add(name, items, generate, *args):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            print(f"Generating {path}")
+            generate(path, *args, seed=seed, variant=0 if 'before' in name else 1)
+        inputs[name] = (path, items)
+
+    add('overlay.txt', OVERLAY_FRAMES * factor, bench_inputs.write_overlay_log, OVERLAY_FRAMES * factor)
+    for name in ['traces-before.csv', 'traces-after.csv']:
+        add(name, TRACES * factor * TRACE_SAMPLES, bench_inputs.write_trace_samples, TRACES * factor, TRACE_SAMPLES)
+    for name in ['failures-before.csv', 'failures-after.csv']:
+        add(name, FAILURES_CASES * factor, bench_inputs.write_failures_csv, FAILURES_CASES * factor)
+    # The number of cases of a qpa file depends on the size of their
+    # logs, so only its size is used
+    for name in ['before.qpa', 'after.qpa']:
+        add(name, None, bench_inputs.write_qpa, QPA_SIZE * factor)
+    return inputs
+
+def get_benchmarks(inputs):
+    """Returns (name, command, input names) of each benchmark"""
+    def path(name):
+        return inputs[name][0]
+
+    python = sys.executable
+    return [
+        ('fps-summary', [python, os.path.join(FPS_ANALYSIS_DIR, 'fps-summary.py'), path('overlay.txt')],
+         ['overlay.txt']),
+        ('report-fps-traces', [python, os.path.join(FPS_ANALYSIS_DIR, 'report-fps-traces.py'),
+                               path('traces-before.csv'), path('traces-after.csv')],
+         ['traces-before.csv', 'traces-after.csv']),
+        ('check-regressions-from-csv', [python, os.path.join(DEQP_DIR, 'deqp-runner-check-regressions-from-csv.py'),
+                                        path('failures-before.csv'), path('failures-after.csv')],
+         ['failures-before.csv', 'failures-after.csv']),
+        ('deqp-list-fail.sh', ['bash', os.path.join(DEQP_LIST_DIR, 'deqp-list-fail.sh'), path('after.qpa')],
+         ['after.qpa']),
+        ('deqp-list-regressions.sh', ['bash', os.path.join(DEQP_LIST_DIR, 'deqp-list-regressions.sh'),
+                                      path('before.qpa'), path('after.qpa')],
+         ['before.qpa', 'after.qpa']),
+        ('deqp-list.py fail', [python, os.path.join(DEQP_LIST_DIR, 'deqp-list.py'), 'fail', path('after.qpa')],
+         ['after.qpa']),
+        ('deqp-list.py regressions', [python, os.path.join(DEQP_LIST_DIR, 'deqp-list.py'), 'regressions',
+                                      path('before.qpa'), path('after.qpa')],
+         ['before.qpa', 'after.qpa']),
+    ]
+
+def get_scripts_dir(data_dir):
+    """deqp-list-regressions.sh calls deqp-list-pass.sh from the PATH,
+    and the scripts are not executable, so they are called through
+    wrappers on the returned directory"""
+    directory = os.path.join(data_dir, 'bin')
+    os.makedirs(directory, exist_ok=True)
+    for script in os.listdir(DEQP_LIST_DIR):
+        if script.endswith('.sh'):
+            path = os.path.join(directory, script)
+            with open(path, 'w') as file_obj:
+                file_obj.write(f'#!/bin/sh\nexec bash "{os.path.join(DEQP_LIST_DIR, script)}" "$@"\n')
+            os.chmod(path, 0o755)
+    return directory
+
+def get_env(scripts_dir):
+    return dict(os.environ, PATH=scripts_dir + os.pathsep + os.environ.get('PATH', ''))
+
+def run_command(command, cwd, scripts_dir):
+    """Returns the (wall time, peak rss in KB) of the command. The peak
+    rss of a pipeline (ie: the shell scripts) is the one of its biggest
+    process."""
+    env = get_env(scripts_dir)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # The stderr of the tools is small, and only read once they exit
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stderr = process.stderr.read().decode('utf-8', 'replace')
+    process.stderr.close()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+    return elapsed, rusage.ru_maxrss
+
+def get_listed_cases(command, scripts_dir):
+    output = subprocess.run(command, cwd=os.path.dirname(command[1]), env=get_env(scripts_dir),
+                            capture_output=True, check=True)
+    return [line.split('  :')[0] for line in output.stdout.decode('utf-8', 'replace').splitlines()]
+
+def check_outputs(benchmarks, scripts_dir):
+    """Returns the names of the benchmarks of OUTPUT_CHECKS that list no
+    cases, or other cases than their counterpart"""
+    commands = {name: command for name, command, _ in benchmarks}
+    failed = set()
+    for pair in OUTPUT_CHECKS:
+        if not all(name in commands for name in pair):
+            continue
+        try:
+            outputs = [get_listed_cases(commands[name], scripts_dir) for name in pair]
+        except (OSError, subprocess.CalledProcessError) as err:
+            print(f"ERROR checking the output of {' and '.join(pair)} : {type(err).__name__} was raised: {err}")
+            failed.update(pair)
+            continue
+        if not outputs[0] or outputs[0] != outputs[1]:
+            print(f"ERROR {pair[0]} ({len(outputs[0])} cases) and {pair[1]} ({len(outputs[1])} cases) "
+                  f"don't list the same cases")
+            failed.update(pair)
+    return failed
+
+def run_benchmark(command, inputs, input_names, repeat, scripts_dir):
+    """Returns the results of the benchmark. The best time of the runs is
+    used, as the others are slowed down by the rest of the system."""
+    runs = [run_command(command, os.path.dirname(command[1]), scripts_dir) for _ in range(repeat)]
+    seconds = min(elapsed for elapsed, _ in runs)
+    input_bytes = sum(os.path.getsize(inputs[name][0]) for name in input_names)
+    items = [inputs[name][1] for name in input_names]
+    result = {
+        'seconds': round(seconds, 4),
+        'input_mb': round(input_bytes / 1e6, 3),
+        'mb_per_s': round(input_bytes / 1e6 / seconds, 3),
+        'items_per_s': None,
+        'peak_rss_mb': round(max(rss for _, rss in runs) / 1024.0, 2),
+    }
+    if None not in items:
+        result['items_per_s'] = round(sum(items) / seconds, 1)
+    return result
+
+def compare(baseline, results, tolerance):
+    """Prints the benchmarks slower or using more memory than on the
+    baseline, and returns how many they are"""
+    regressions = 0
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            before = baseline['results'].get(scale, {}).get(name)
+            if before is None:
+                continue
+            for field, label in [('seconds', 'time'), ('peak_rss_mb', 'peak RSS')]:
+                change = result[field] / before[field] - 1.0 if before[field] else 0.0
+                if change > tolerance:
+                    print(f"REGRESSION: {scale}: {name}: {label} {before[field]} -> {result[field]} (+{change * 100:.1f}%)")
+                    regressions += 1
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmarks", "-b", default=[], action="append", metavar="<name>", help="Only run the named benchmark (can be used more than once)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare the results with a baseline saved with --save, exiting with an error if there are regressions")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.expanduser('~'), '.cache', 'mesa-resources-benchmarks'), help="Directory where the generated inputs are kept (default ~/.cache/mesa-resources-benchmarks)")
+    parser.add_argument("--repeat", default=3, type=int, help="Number of runs of each benchmark (default 3)")
+    parser.add_argument("--save", metavar="BASELINE", help="Save the results as a json baseline")
+    parser.add_argument("--scales", default="small,medium", help=f"Comma separated scales to run, of {', '.join(SCALES)} (default small,medium)")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the generated inputs (default 0)")
+    parser.add_argument("--tolerance", default=0.2, type=float, help="With --compare, relative increase of the time or peak RSS considered a regression (default 0.2)")
+
+    args = parser.parse_args()
+
+    scales = args.scales.split(',')
+    for scale in scales:
+        if scale not in SCALES:
+            print(f"Unknown scale {scale}, the scales are: {', '.join(SCALES)}")
+            return 1
+
+    scripts_dir = get_scripts_dir(args.data_dir)
+    results = {}
+    for scale in scales:
+        inputs = get_inputs(args.data_dir, scale, args.seed)
+        results[scale] = {}
+        benchmarks = [benchmark for benchmark in get_benchmarks(inputs)
+                      if not args.benchmarks or benchmark[0] in args.benchmarks]
+        failed = check_outputs(benchmarks, scripts_dir)
+        for name, command, input_names in benchmarks:
+            if name in failed:
+                continue
+            try:
+                result = run_benchmark(command, inputs, input_names, args.repeat, scripts_dir)
+            except (OSError, subprocess.CalledProcessError) as err:
+                print(f"ERROR running {name} ({scale}) : {type(err).__name__} was raised: {err}")
+                continue
+            results[scale][name] = result
+            items_per_s = f", {result['items_per_s']:.0f} items/s" if result['items_per_s'] is not None else ""
+            print(f"{scale}: {name}: {result['seconds']:.3f}s, {result['mb_per_s']:.1f} MB/s{items_per_s}, "
+                  f"peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    if args.save is not None:
+        with open(args.save, 'w') as file_obj:
+            json.dump({
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'seed': args.seed,
+                'results': results,
+            }, file_obj, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file_obj:
+            baseline = json.load(file_obj)
+        if baseline.get('seed') != args.seed:
+            print(f"Warning: the baseline was generated with seed {baseline.get('seed')}")
+        if compare(baseline, results, args.tolerance):
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
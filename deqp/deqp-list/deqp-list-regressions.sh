@@ -16,7 +16,8 @@ NEW_PASSES=$(mktemp /tmp/deqp-regressions-XXX.txt)
 deqp-list-pass.sh $1 > $OLD_PASSES
 deqp-list-pass.sh $2 > $NEW_PASSES
 
-DIFF=$(diff -au $OLD_PASSES $NEW_PASSES | grep "^- " | cut -d* -f2)
+# The removed lines of the diff are "-<case>", its header "--- <file>"
+DIFF=$(diff -au $OLD_PASSES $NEW_PASSES | grep "^-[^-]" | cut -c2-)
 
 for CASE in $DIFF ; do
     awk "/#beginTestCaseResult $CASE/ { show=1 } show; /#endTestCaseResult/ { if (show==1) exit }" $2 | \
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Python replacement of the deqp-list-*.sh scripts. Each qpa file is
+# read only once, so it can be used with the qpa files of a full
+# conformance run.
+#
+#   deqp-list.py pass <qpa>              : like deqp-list-pass.sh
+#   deqp-list.py fail <qpa>              : like deqp-list-fail.sh
+#   deqp-list.py waive <qpa>             : like deqp-list-waive.sh
+#   deqp-list.py terminated <qpa>        : like deqp-list-terminated.sh
+#   deqp-list.py regressions <old> <new> : like deqp-list-regressions.sh
+#
+# It can also look up single cases, using an index of the qpa file
+# (<qpa>.idx) that is built on first use, and rebuilt if the qpa file
+# changes:
+#
+#   deqp-list.py status <qpa> <case>...  : status of the cases
+#   deqp-list.py extract <qpa> <case>... : qpa text of the cases
+#   deqp-list.py query <qpa> <glob>      : status of the matching cases
+#
+# Note that terminated lists the cases terminated for any reason (ie:
+# Crash or Timeout), not only those with the "Terminated" reason.
+#
+import argparse
+
+import qpa
+import qpa_index
+
+STATUS_BY_COMMAND = {
+    'pass': 'Pass',
+    'fail': 'Fail',
+    'waive': 'Waiver',
+    'terminated': qpa.TERMINATED,
+}
+
+def list_status(filename, status):
+    for case, case_status, detail in qpa.read_results(filename):
+        if case_status == status:
+            print(case)
+
+# Lists the tests that passed on the old results, but don't pass
+# anymore on the new ones, for any reason. Unlike the shell version,
+# this reads the new file once, instead of once per regression.
+def list_regressions(old_filename, new_filename):
+    old_passes = set(case for case, status, detail in qpa.read_results(old_filename)
+                     if status == 'Pass')
+
+    for case, status, detail in qpa.read_results(new_filename):
+        if case in old_passes and status != 'Pass':
+            print(f"{case}  : {status} ({detail})")
+
+def print_status(filename, cases):
+    index = qpa_index.QpaIndex(filename)
+    for case in cases:
+        entry = index.lookup(case)
+        print(f"{case}  : {entry[2] if entry is not None else 'NotFound'}")
+    index.close()
+
+def print_cases(filename, cases):
+    index = qpa_index.QpaIndex(filename)
+    for case in cases:
+        text = index.extract(case)
+        if text is None:
+            print(f"{case} not found")
+        else:
+            print(text, end='')
+    index.close()
+
+def print_query(filename, pattern):
+    index = qpa_index.QpaIndex(filename)
+    for case, status in index.glob(pattern):
+        print(f"{case}  : {status}")
+    index.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command in STATUS_BY_COMMAND:
+        subparser = subparsers.add_parser(command, help=f"List the {STATUS_BY_COMMAND[command]} tests")
+        subparser.add_argument("results_file", help="qpa file")
+
+    subparser = subparsers.add_parser('regressions', help="List the tests that passed on the old results, but don't pass on the new ones")
+    subparser.add_argument("old_results_file", help="old qpa file")
+    subparser.add_argument("new_results_file", help="new qpa file")
+
+    for command, help_text in (('status', "Show the status of the cases"),
+                               ('extract', "Show the qpa text of the cases")):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument("results_file", help="qpa file")
+        subparser.add_argument("cases", nargs='+', help="case names")
+
+    subparser = subparsers.add_parser('query', help="Show the status of the cases matching a glob pattern (ie: 'dEQP-VK.api.*')")
+    subparser.add_argument("results_file", help="qpa file")
+    subparser.add_argument("pattern", help="glob pattern")
+
+    args = parser.parse_args()
+
+    if args.command == 'regressions':
+        list_regressions(args.old_results_file, args.new_results_file)
+    elif args.command == 'status':
+        print_status(args.results_file, args.cases)
+    elif args.command == 'extract':
+        print_cases(args.results_file, args.cases)
+    elif args.command == 'query':
+        print_query(args.results_file, args.pattern)
+    else:
+        list_status(args.results_file, STATUS_BY_COMMAND[args.command])
+
+if __name__ == "__main__":
+    main()
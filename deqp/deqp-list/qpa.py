@@ -0,0 +1,72 @@
+#
+# Single-pass reader of dEQP/CTS TestResults.qpa files.
+#
+# The file is memory-mapped and walked once from the start, jumping
+# between the "#beginTestCaseResult" markers, so it works with the
+# several GB qpa files of a conformance run (unlike sed, that fails
+# past 2GB).
+#
+import mmap
+import os
+
+BEGIN_MARKER = b'#beginTestCaseResult '
+TERMINATE_MARKER = b'#terminateTestCaseResult'
+STATUS_CODE = b'StatusCode="'
+RESULT_END = b'</Result>'
+
+# Status of the cases without StatusCode. TERMINATED cases have the
+# terminate reason as detail (ie: Crash, Timeout). INCOMPLETE cases are
+# those without StatusCode nor terminate record, like the last case of a
+# truncated qpa file.
+TERMINATED = 'Terminated'
+INCOMPLETE = 'Incomplete'
+
+def parse_case(data, begin, end):
+    """Returns (case, status, detail) of the test case result between
+    the begin and end offsets of data"""
+    name_start = begin + len(BEGIN_MARKER)
+    name_end = data.find(b'\n', name_start, end)
+    if name_end == -1:
+        name_end = end
+    case = data[name_start:name_end].strip().decode('utf-8', 'replace')
+
+    terminate = data.rfind(TERMINATE_MARKER, name_end, end)
+    if terminate != -1:
+        reason_end = data.find(b'\n', terminate, end)
+        if reason_end == -1:
+            reason_end = end
+        reason = data[terminate + len(TERMINATE_MARKER):reason_end].strip()
+        return case, TERMINATED, reason.decode('utf-8', 'replace')
+
+    # The <Result> element is at the end of the case log
+    status = data.rfind(STATUS_CODE, name_end, end)
+    if status == -1:
+        return case, INCOMPLETE, ''
+
+    code_start = status + len(STATUS_CODE)
+    code_end = data.find(b'"', code_start, end)
+    detail_start = data.find(b'>', code_end, end) + 1
+    detail_end = data.find(RESULT_END, detail_start, end)
+    if detail_end == -1:
+        detail_end = detail_start
+    return (case,
+            data[code_start:code_end].decode('utf-8', 'replace'),
+            data[detail_start:detail_end].decode('utf-8', 'replace'))
+
+def iter_cases(data):
+    """Yields (begin, end) offsets of each test case result of data"""
+    begin = data.find(BEGIN_MARKER)
+    while begin != -1:
+        next_begin = data.find(BEGIN_MARKER, begin + len(BEGIN_MARKER))
+        end = next_begin if next_begin != -1 else len(data)
+        yield begin, end
+        begin = next_begin
+
+def read_results(filename):
+    """Yields (case, status, detail) for each test case result of the qpa file"""
+    with open(filename, 'rb') as file_obj:
+        if os.fstat(file_obj.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for begin, end in iter_cases(data):
+                yield parse_case(data, begin, end)
@@ -0,0 +1,154 @@
+#
+# Persistent byte-offset index of a qpa file, so single test case
+# results can be found without scanning the whole qpa file.
+#
+# The index is stored next to the qpa file (<qpa>.idx), and rebuilt
+# when the size or mtime of the qpa file change. Its layout is:
+#
+#   header:   magic, qpa size, qpa mtime, number of cases, size of the
+#             status table
+#   statuses: the different status strings, separated by '\n'
+#   entries:  one fixed-size entry per case, sorted by case name, with
+#             the offset/length of the name on the names blob, the
+#             offset/length of the case on the qpa file, and the index
+#             of its status on the status table
+#   names:    all the case names, concatenated
+#
+# As entries have a fixed size, they are binary searched directly on
+# the memory-mapped index, without loading it.
+#
+import fnmatch
+import mmap
+import os
+import struct
+
+import qpa
+
+MAGIC = b'QPAIDX1\0'
+HEADER = struct.Struct('<8sQqQQ')
+ENTRY = struct.Struct('<QHQIB')
+INDEX_SUFFIX = '.idx'
+
+def get_index_filename(qpa_filename):
+    return qpa_filename + INDEX_SUFFIX
+
+def build_index(qpa_filename, index_filename):
+    stat = os.stat(qpa_filename)
+    entries = []
+    if stat.st_size > 0:
+        with open(qpa_filename, 'rb') as file_obj:
+            with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for begin, end in qpa.iter_cases(data):
+                    case, status, detail = qpa.parse_case(data, begin, end)
+                    entries.append((case.encode('utf-8'), begin, end - begin, status))
+    entries.sort()
+
+    statuses = sorted(set(entry[3] for entry in entries))
+    status_index = {status: i for i, status in enumerate(statuses)}
+    statuses_blob = '\n'.join(statuses).encode('utf-8')
+
+    # Written to a temporary file first, so a concurrent reader never
+    # sees a half-written index
+    tmp_filename = index_filename + '.tmp'
+    with open(tmp_filename, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns,
+                                     len(entries), len(statuses_blob)))
+        index_file.write(statuses_blob)
+        name_offset = 0
+        for name, offset, length, status in entries:
+            index_file.write(ENTRY.pack(name_offset, len(name), offset, length,
+                                        status_index[status]))
+            name_offset += len(name)
+        for entry in entries:
+            index_file.write(entry[0])
+    os.replace(tmp_filename, index_filename)
+
+def is_index_valid(qpa_filename, index_filename):
+    try:
+        with open(index_filename, 'rb') as index_file:
+            header = index_file.read(HEADER.size)
+    except FileNotFoundError:
+        return False
+    if len(header) != HEADER.size:
+        return False
+    magic, size, mtime_ns, count, statuses_len = HEADER.unpack(header)
+    stat = os.stat(qpa_filename)
+    return magic == MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+class QpaIndex:
+    """Index of a qpa file, built (or rebuilt, if stale) when opened"""
+
+    def __init__(self, qpa_filename):
+        self.qpa_filename = qpa_filename
+        index_filename = get_index_filename(qpa_filename)
+        if not is_index_valid(qpa_filename, index_filename):
+            build_index(qpa_filename, index_filename)
+
+        with open(index_filename, 'rb') as index_file:
+            self.data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, mtime_ns, self.count, statuses_len = HEADER.unpack_from(self.data)
+        statuses_blob = self.data[HEADER.size:HEADER.size + statuses_len]
+        self.statuses = statuses_blob.decode('utf-8').split('\n') if statuses_blob else []
+        self.entries_offset = HEADER.size + statuses_len
+        self.names_offset = self.entries_offset + self.count * ENTRY.size
+
+    def close(self):
+        self.data.close()
+
+    def get_entry(self, i):
+        name_offset, name_length, offset, length, status = ENTRY.unpack_from(
+            self.data, self.entries_offset + i * ENTRY.size)
+        start = self.names_offset + name_offset
+        return self.data[start:start + name_length], offset, length, self.statuses[status]
+
+    def lower_bound(self, name):
+        """Index of the first entry not smaller than name"""
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_entry(middle)[0] < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, case):
+        """Returns (offset, length, status) of the case, or None"""
+        name = case.encode('utf-8')
+        i = self.lower_bound(name)
+        if i < self.count:
+            entry = self.get_entry(i)
+            if entry[0] == name:
+                return entry[1:]
+        return None
+
+    def extract(self, case):
+        """Returns the qpa text of the case result, or None"""
+        entry = self.lookup(case)
+        if entry is None:
+            return None
+        with open(self.qpa_filename, 'rb') as file_obj:
+            file_obj.seek(entry[0])
+            return file_obj.read(entry[1]).decode('utf-8', 'replace')
+
+    def prefix(self, prefix):
+        """Yields (case, status) of the cases starting with prefix"""
+        name_prefix = prefix.encode('utf-8')
+        i = self.lower_bound(name_prefix)
+        while i < self.count:
+            name, offset, length, status = self.get_entry(i)
+            if not name.startswith(name_prefix):
+                break
+            yield name.decode('utf-8'), status
+            i += 1
+
+    def glob(self, pattern):
+        """Yields (case, status) of the cases matching the glob pattern.
+
+        Only the cases starting with the literal prefix of the pattern
+        are checked."""
+        wildcard = min((pattern.find(c) for c in '*?[' if c in pattern), default=len(pattern))
+        for case, status in self.prefix(pattern[:wildcard]):
+            if fnmatch.fnmatchcase(case, pattern):
+                yield case, status
@@ -2,62 +2,117 @@
 
 import csv
 import argparse
+import collections
 
 # We only load the fail, timeout, crashes, as we want changes on
 # that. No need to load the pass files (also, usually we would take
 # the failures.csv from deqp-runner)
+#
+# Several after runs can be compared against the same before run (ie:
+# the nightly runs against a baseline). Then fixes, and flakes (cases
+# whose status is not the same on all the after runs) are also listed.
+# A case that passed before, and fails on at least --min-fail-runs of
+# the after runs (by default, most of them) is a regression instead of
+# a flake, with its most common failing status.
 
-def load_status(file_path):
-    failures = set()
-    timeouts = set()
-    crashes = set()
+# Status of the cases not listed on a failures.csv
+PASS = 0
+FAIL = 1
+CRASH = 2
+TIMEOUT = 3
+
+STATUS_BY_NAME = {
+    'fail': FAIL,
+    'crash': CRASH,
+    'timeout': TIMEOUT,
+}
+STATUS_NAMES = ['pass', 'fail', 'crash', 'timeout']
+
+# The case names are interned on a table shared by all the runs, and
+# the status of each run is stored as a byte per case id, so comparing
+# runs doesn't need to hash the full case names again.
+def load_status(file_path, case_ids):
+    statuses = bytearray(len(case_ids))
     with open(file_path, newline='') as csvfile:
         reader = csv.reader(csvfile)
         for row in reader:
-            if len(row) == 2 and row[1].strip().lower() == 'fail':
-                failures.add(row[0].strip())
-            if len(row) == 2 and row[1].strip().lower() == 'crash':
-                crashes.add(row[0].strip())
-            if len(row) == 2 and row[1].strip().lower() == 'timeout':
-                timeouts.add(row[0].strip())
+            # The failures merged by run-all-opengl-cts.py have the
+            # suite of the case as third column
+            if len(row) not in (2, 3):
+                continue
+            status = STATUS_BY_NAME.get(row[1].strip().lower())
+            if status is None:
+                continue
+            case_id = case_ids.setdefault(row[0].strip(), len(case_ids))
+            if case_id >= len(statuses):
+                statuses.extend(bytes(case_id + 1 - len(statuses)))
+            statuses[case_id] = status
+
+    return statuses
 
-    return [failures, crashes, timeouts]
+def print_section(title, cases):
+    if cases:
+        print(f"** {title} ** ")
+        print("\n".join(sorted(cases)) or "None")
+    else:
+        print(f"\n** No {title.lower()} ** ")
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("before", help="The deqp-runner outcome before")
-    parser.add_argument("after", help="The deqp-runner outcome after")
+    parser.add_argument("after", nargs='+', help="The deqp-runner outcome after (can be more than one)")
+    parser.add_argument("--min-fail-runs", type=int, help="With several after runs, number of them a case that passed before has to fail on to be a regression instead of a flake (default: more than half of them)")
 
     args = parser.parse_args()
 
-    [before_failures, before_crashes, before_timeouts] = load_status(args.before)
-    [after_failures, after_crashes, after_timeouts] = load_status(args.after)
+    min_fail_runs = args.min_fail_runs if args.min_fail_runs is not None else len(args.after) // 2 + 1
+    if min_fail_runs < 1:
+        print("Error - --min-fail-runs has to be at least 1")
+        return
 
-    # FIXME: do we really need three different sets?
-    fail_regressions = after_failures - before_failures
-    crash_regressions = after_crashes - before_crashes
-    timeout_regressions = after_timeouts - before_timeouts
+    case_ids = {}
+    runs = [load_status(f, case_ids) for f in [args.before] + args.after]
+    # Runs loaded before the last case ids were added are shorter
+    for statuses in runs:
+        statuses.extend(bytes(len(case_ids) - len(statuses)))
+    case_names = list(case_ids)
 
-    # Print the results
-    if fail_regressions:
-        print("** Fail regressions ** ")
-        print("\n".join(sorted(fail_regressions)) or "None")
-    else:
-        print("\n** No fail regressions ** ")
+    regressions = {FAIL: [], CRASH: [], TIMEOUT: []}
+    fixes = []
+    flakes = []
 
-    if crash_regressions:
-        print("** Crash regressions ** ")
-        print("\n".join(sorted(crash_regressions)) or "None")
-    else:
-        print("\n** No crash regressions ** ")
+    before = runs[0]
+    after_runs = runs[1:]
+    for case_id in range(len(case_names)):
+        after_statuses = set(statuses[case_id] for statuses in after_runs)
+        if len(after_statuses) > 1:
+            failures = collections.Counter(statuses[case_id] for statuses in after_runs
+                                           if statuses[case_id] != PASS)
+            if before[case_id] == PASS and sum(failures.values()) >= min_fail_runs:
+                regressions[failures.most_common(1)[0][0]].append(case_names[case_id])
+            else:
+                flakes.append(case_id)
+            continue
 
-    if crash_regressions:
-        print("** Timeout regressions ** ")
-        print("\n".join(sorted(timeout_regressions)) or "None")
-    else:
-        print("\n** No timeout regressions ** ")
+        after_status = after_statuses.pop()
+        if after_status == before[case_id]:
+            continue
+        if after_status == PASS:
+            fixes.append(case_names[case_id])
+        else:
+            regressions[after_status].append(case_names[case_id])
+
+    # Print the results
+    print_section("Fail regressions", regressions[FAIL])
+    print_section("Crash regressions", regressions[CRASH])
+    print_section("Timeout regressions", regressions[TIMEOUT])
+
+    if len(args.after) > 1:
+        print_section("Fixes", fixes)
+        print_section("Flakes", [case_names[case_id] + ": " + STATUS_NAMES[runs[0][case_id]] + " -> " +
+                                 ",".join(STATUS_NAMES[statuses[case_id]] for statuses in after_runs)
+                                 for case_id in flakes])
 
 
 if __name__ == "__main__":
     main()
-
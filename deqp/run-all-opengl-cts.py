@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+# Python version of run-all-opengl-cts.sh: runs the mandatory gles2,
+# gles3, gles31, gl30, gl31 and egl tests with deqp-runner. Unlike the
+# shell version, the suites are not run one after another: the
+# mustpass caselist of each suite is split in shards, and the shards of
+# all the suites are run concurrently within a global job budget, so
+# the slowest suite doesn't set the time of the whole run.
+#
+# The shards are balanced with the duration of each case on the
+# results.csv of previous runs (by default, the previous run on the
+# output directory). The cases without history are estimated with the
+# median duration of those with it.
+#
+# The results of the shards are merged on the output directory:
+#
+#   <output>/results.csv          : case,status,duration,suite
+#   <output>/all-opengl-cts.csv   : case,status,suite of the failures
+#   <output>/<suite>/shard-<n>/   : the deqp-runner output of each shard
+#
+# all-opengl-cts.csv can be passed directly to
+# deqp-runner-check-regressions-from-csv.py.
+#
+# Example:
+#
+#   ./run-all-opengl-cts.py --jobs 16 --output opengl-cts
+#
+import argparse
+import concurrent.futures
+import csv
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+# name, caselist (relative to the vk-gl-cts source), extra deqp options
+SUITES = [
+    ('gles2', 'external/openglcts/data/gl_cts/data/mustpass/gles/khronos_mustpass/main/gles2-khr-main.txt', []),
+    ('gles3', 'external/openglcts/data/gl_cts/data/mustpass/gles/khronos_mustpass/main/gles3-khr-main.txt', []),
+    ('gles31', 'external/openglcts/data/gl_cts/data/mustpass/gles/khronos_mustpass/main/gles31-khr-main.txt', []),
+    ('gl30', 'external/openglcts/data/gl_cts/data/mustpass/gl/khronos_mustpass/main/gl30-main.txt',
+     ['--deqp-terminate-on-device-lost=disable']),
+    ('gl31', 'external/openglcts/data/gl_cts/data/mustpass/gl/khronos_mustpass/main/gl31-main.txt',
+     ['--deqp-terminate-on-device-lost=disable']),
+    ('egl', 'external/openglcts/data/gl_cts/data/mustpass/egl/aosp_mustpass/main/egl-main.txt',
+     ['--deqp-terminate-on-device-lost=disable']),
+]
+
+RESULTS_FILENAME = 'results.csv'
+FAILURES_FILENAME = 'failures.csv'
+MERGED_FAILURES_FILENAME = 'all-opengl-cts.csv'
+
+# Duration of the cases when there is no history at all
+DEFAULT_DURATION = 0.1
+# Shards per job, so the shards finishing early don't leave jobs idle
+# at the end of the run
+SHARDS_PER_JOB = 2
+
+def read_caselist(filename):
+    with open(filename) as file_obj:
+        return [line.strip() for line in file_obj if line.strip() and not line.startswith('#')]
+
+def read_durations(paths):
+    """Returns a dict with the duration of each case on the results.csv
+    files (or directories containing them). The last one wins."""
+    durations = {}
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = []
+            for directory, _, files in os.walk(path):
+                if RESULTS_FILENAME in files:
+                    filenames.append(os.path.join(directory, RESULTS_FILENAME))
+        else:
+            filenames = [path]
+        for filename in sorted(filenames):
+            with open(filename, newline='') as file_obj:
+                for row in csv.reader(file_obj):
+                    if len(row) < 3:
+                        continue
+                    try:
+                        durations[row[0]] = float(row[2])
+                    except ValueError:
+                        pass
+    return durations
+
+def get_shards(cases, durations, default_duration, num_shards):
+    """Splits the cases in num_shards shards with about the same
+    duration (longest case first to the shortest shard). Returns a list
+    of (estimated duration, cases)."""
+    shards = [[0.0, []] for _ in range(num_shards)]
+    for case in sorted(cases, key=lambda case: durations.get(case, default_duration), reverse=True):
+        shard = min(shards, key=lambda shard: shard[0])
+        shard[0] += durations.get(case, default_duration)
+        shard[1].append(case)
+    # deqp runs the cases faster in the caselist order (ie: shared setup)
+    order = {case: index for index, case in enumerate(cases)}
+    return [(duration, sorted(shard_cases, key=order.get)) for duration, shard_cases in shards if shard_cases]
+
+def run_shard(args, suite, index, extra_args, cases):
+    """Runs the shard with deqp-runner, and returns its output directory"""
+    suite_directory = os.path.join(args.output, suite)
+    shard_directory = os.path.join(suite_directory, f"shard-{index}")
+    caselist = os.path.join(suite_directory, f"shard-{index}.txt")
+    with open(caselist, 'w') as file_obj:
+        file_obj.write('\n'.join(cases) + '\n')
+
+    command = [args.deqp_runner, 'run', '--deqp', args.deqp, '--output', shard_directory,
+               '--caselist', caselist, '--jobs', '1']
+    command += ['--'] + extra_args if extra_args else []
+    # deqp-runner exits with an error if there are failures, so only a
+    # missing results.csv is an error
+    with open(os.path.join(suite_directory, f"shard-{index}.log"), 'w') as log:
+        subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+    if not os.path.exists(os.path.join(shard_directory, RESULTS_FILENAME)):
+        raise RuntimeError(f"deqp-runner didn't write the results, see {suite_directory}/shard-{index}.log")
+    return shard_directory
+
+def merge_results(output, shard_directories):
+    """Merges the results and failures of the shards, adding the suite
+    of each case. Returns a dict with the status counts of each suite."""
+    counts = {}
+    with open(os.path.join(output, RESULTS_FILENAME), 'w', newline='') as results_obj, \
+         open(os.path.join(output, MERGED_FAILURES_FILENAME), 'w', newline='') as failures_obj:
+        results = csv.writer(results_obj)
+        failures = csv.writer(failures_obj)
+        for suite, shard_directory in shard_directories:
+            suite_counts = counts.setdefault(suite, {})
+            with open(os.path.join(shard_directory, RESULTS_FILENAME), newline='') as file_obj:
+                for row in csv.reader(file_obj):
+                    if len(row) < 3:
+                        continue
+                    results.writerow(row[:3] + [suite])
+                    suite_counts[row[1]] = suite_counts.get(row[1], 0) + 1
+            failures_filename = os.path.join(shard_directory, FAILURES_FILENAME)
+            if os.path.exists(failures_filename):
+                with open(failures_filename, newline='') as file_obj:
+                    for row in csv.reader(file_obj):
+                        if len(row) >= 2:
+                            failures.writerow(row[:2] + [suite])
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cts-source", default=os.path.expanduser('~/mesa/source/vk-gl-cts'), help="vk-gl-cts source directory, with the mustpass caselists (default ~/mesa/source/vk-gl-cts)")
+    parser.add_argument("--deqp", default='./glcts', help="glcts binary (default ./glcts)")
+    parser.add_argument("--deqp-runner", default='deqp-runner', help="deqp-runner binary (default deqp-runner from the PATH)")
+    parser.add_argument("--history", default=[], action="append", metavar="<results.csv>", help="results.csv file (or directory with them) of a previous run, to balance the shards (can be used more than once, default: the previous run on the output directory)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of deqp processes run at once, for all the suites (default: number of cpus)")
+    parser.add_argument("--output", "-o", default='opengl-cts', help="Output directory (default opengl-cts)")
+    parser.add_argument("--suites", default=','.join(suite[0] for suite in SUITES), help=f"Comma separated suites to run (default {','.join(suite[0] for suite in SUITES)})")
+
+    args = parser.parse_args()
+
+    suites = [suite for suite in SUITES if suite[0] in args.suites.split(',')]
+    unknown = set(args.suites.split(',')) - set(suite[0] for suite in SUITES)
+    if unknown:
+        print(f"Unknown suites {', '.join(sorted(unknown))}")
+        return 1
+
+    # The previous run has to be read before its output is removed
+    durations = read_durations(args.history or ([args.output] if os.path.isdir(args.output) else []))
+    default_duration = statistics.median(durations.values()) if durations else DEFAULT_DURATION
+
+    caselists = {}
+    for name, caselist, _ in suites:
+        try:
+            caselists[name] = read_caselist(os.path.join(args.cts_source, caselist))
+        except OSError as err:
+            print(f"ERROR reading the caselist of {name} : {type(err).__name__} was raised: {err}")
+            return 1
+
+    # Each suite gets a number of shards proportional to its estimated
+    # duration
+    estimates = {name: sum(durations.get(case, default_duration) for case in cases)
+                 for name, cases in caselists.items()}
+    total_estimate = sum(estimates.values()) or 1.0
+    shards = []
+    for name, _, extra_args in suites:
+        num_shards = max(1, round(args.jobs * SHARDS_PER_JOB * estimates[name] / total_estimate))
+        suite_shards = get_shards(caselists[name], durations, default_duration, num_shards)
+        for index, (estimate, cases) in enumerate(suite_shards):
+            shards.append((estimate, name, index, extra_args, cases))
+        print(f"{name}: {len(caselists[name])} cases, {len(suite_shards)} shards, estimated {estimates[name]:.0f}s")
+
+    for name, _, _ in suites:
+        shutil.rmtree(os.path.join(args.output, name), ignore_errors=True)
+        os.makedirs(os.path.join(args.output, name))
+
+    # The longest shards first, so the run doesn't end waiting for one
+    shards.sort(key=lambda shard: shard[0], reverse=True)
+    start = time.monotonic()
+    shard_directories = []
+    errors = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(run_shard, args, name, index, extra_args, cases): (estimate, name, index)
+                   for estimate, name, index, extra_args, cases in shards}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            estimate, name, index = futures[future]
+            try:
+                shard_directories.append((name, future.result()))
+            except Exception as err:
+                print(f"ERROR running {name} shard {index} : {type(err).__name__} was raised: {err}")
+                errors += 1
+                continue
+            print(f"[{done}/{len(shards)}] {name} shard {index} done at {time.monotonic() - start:.0f}s "
+                  f"(estimated {estimate:.0f}s)")
+
+    # Sorted, so the merged files have the same order on every run
+    shard_directories.sort(key=lambda shard: ([suite[0] for suite in suites].index(shard[0]),
+                                              int(shard[1].rsplit('-', 1)[1])))
+    counts = merge_results(args.output, shard_directories)
+    for name, suite_counts in counts.items():
+        print(f"{name}: " + ", ".join(f"{status}: {count}" for status, count in sorted(suite_counts.items())))
+    print(f"Failures written to {os.path.join(args.output, MERGED_FAILURES_FILENAME)}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,10 @@
 # default configuration, while a conformance run (ie: ./cts-runner
 # --type=es31), would run only for es31 but with a lot of different
 # configurations.
+#
+# run-all-opengl-cts.py does the same, but running the suites
+# concurrently (sharded by the case durations of previous runs), and
+# keeping the suite of each failure on the merged csv.
 
 deqp-runner run --deqp ./glcts --output gles2.log  --caselist ~/mesa/source/vk-gl-cts/external/openglcts/data/gl_cts/data/mustpass/gles/khronos_mustpass/main/gles2-khr-main.txt
 deqp-runner run --deqp ./glcts --output gles3.log  --caselist ~/mesa/source/vk-gl-cts/external/openglcts/data/gl_cts/data/mustpass/gles/khronos_mustpass/main/gles3-khr-main.txt
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Python version of run-n-times-flaky-deqp-case.sh: runs a deqp/cts
+# test n times, to debug flaky tests. Unlike the shell version, the
+# runs are done in parallel, each one isolated on its own scratch
+# directory (its current directory, also holding its qpa file through
+# --deqp-log-filename), and each run is classified with the StatusCode
+# of its qpa file (Pass, Fail, Crash, Timeout, QualityWarning...)
+# instead of just pass or fail.
+#
+# The qpa file of each run that didn't pass is kept as
+# TestResults_<run>_<status>.qpa (use --keep-passes to keep all of them).
+#
+# Example:
+#
+#   ./run-n-times-flaky-deqp-case.py 1000 --jobs 16 -- ./deqp-vk -n dEQP-VK.api.foo
+#
+import argparse
+import collections
+import concurrent.futures
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deqp-list'))
+import qpa
+
+LOG_FILENAME = 'TestResults.qpa'
+
+def get_status(log_filename, returncode):
+    if not os.path.exists(log_filename):
+        return 'NoResult'
+
+    statuses = [(status, detail) for case, status, detail in qpa.read_results(log_filename)]
+    if len(statuses) == 0:
+        return 'NoResult'
+
+    status, detail = statuses[0]
+    if status == qpa.TERMINATED:
+        return detail or qpa.TERMINATED
+    if status == qpa.INCOMPLETE and returncode != 0:
+        return 'Crash'
+    return status
+
+def run_once(command, index, keep_passes):
+    scratch_directory = tempfile.mkdtemp(prefix=f"flaky-deqp-{index}-")
+    log_filename = os.path.join(scratch_directory, LOG_FILENAME)
+    try:
+        # Each run is done on its scratch directory, so the files written
+        # by the case (ie: shader caches, dumped images) don't collide
+        output = subprocess.run(command + ['--deqp-log-filename=' + log_filename],
+                                cwd=scratch_directory,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        status = get_status(log_filename, output.returncode)
+        if os.path.exists(log_filename) and (status != 'Pass' or keep_passes):
+            shutil.move(log_filename, f"TestResults_{index}_{status}.qpa")
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+    return status
+
+def print_histogram(statuses, n):
+    counts = collections.Counter(statuses)
+    width = max(len(status) for status in counts)
+    for status, count in counts.most_common():
+        bar = '#' * max(1, round(50 * count / n))
+        print(f"{status:<{width}} : {count:>6} ({100.0 * count / n:6.2f}%) {bar}")
+
+def main():
+    parser = argparse.ArgumentParser(usage="%(prog)s [-h] [--jobs JOBS] [--keep-passes] n -- command...")
+    parser.add_argument("n", type=int, help="Number of runs")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of runs done in parallel (default: number of cpus)")
+    parser.add_argument("--keep-passes", action="store_true", help="Also keep the qpa files of the runs that passed")
+
+    # The command running the test goes after "--", so its options are
+    # not parsed as ours
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    args = parser.parse_args(argv)
+
+    if args.n < 1 or args.jobs < 1:
+        print("Error - n and --jobs have to be at least 1")
+        return 1
+
+    if not command:
+        print("Error - no command to run after --")
+        return 1
+
+    # The runs are not done on the current directory, so the binary and
+    # the test data (that deqp looks for on the current directory by
+    # default) are given with absolute paths
+    if os.sep in command[0]:
+        command[0] = os.path.abspath(command[0])
+    if not any(arg.startswith('--deqp-archive-dir') for arg in command):
+        command.append('--deqp-archive-dir=' + os.getcwd())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        statuses = list(executor.map(lambda i: run_once(command, i, args.keep_passes),
+                                     range(1, args.n + 1)))
+
+    print(f"Runs: {args.n}")
+    print_histogram(statuses, args.n)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
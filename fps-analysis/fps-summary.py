@@ -4,68 +4,99 @@
 #
 # VK_INSTANCE_LAYERS=VK_LAYER_MESA_overlay VK_LAYER_MESA_OVERLAY_CONFIG=output_file=/tmp/output.txt ./vk-app
 #
-# it computes the average, min and max fps
+# it computes the average, min and max fps. It also computes the frame
+# pacing stats (1%/0.1% lows, p95/p99 frame times and stutters), that
+# are per-frame if the overlay is configured with fps_sampling_period=0
+#
+# The overlay files are read line by line, and the frame pacing stats
+# are approximated with a sketch (1% relative error), so memory usage
+# doesn't depend on the size of the files. Several files are summarized
+# in parallel.
 #
 import argparse
+import concurrent.futures
+import math
 
-def main():
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument("fps_file", help="fps file")
-    parser.add_argument("-max_samples", nargs='?', const=0, type=int, help="max number of samples to use")
-
-    args = parser.parse_args()
-
-    file = open(args.fps_file, "r")
-    lines = file.read().split('\n')
+import fps_stats
 
-    current_line = 0
+def summarize(fps_file, max_samples):
     total_value = 0
-    min_fps = 666
+    min_fps = math.inf
     max_fps = 0
-    max_samples = 0
     num_samples = 0
-    fps_index = -1
-    if args.max_samples is not None:
-        max_samples = args.max_samples
-    else:
-        max_samples = -1
-
-    for line in lines:
-        parsed_line = line.split(', ')
+    sketch = fps_stats.FrameTimeSketch()
 
+    with open(fps_file, "r") as file:
         # Assumes that the first line would be the header
-        if current_line == 0:
-            word_count = 0;
-            for word in parsed_line:
-                if (word == 'fps'):
-                    fps_index = word_count
-                    break
-                word_count += 1
-
-            if (fps_index == -1):
-                print("'fps' column not found (missing header?)")
+        header = file.readline().rstrip('\n').split(', ')
+        if 'fps' not in header:
+            return None
+        fps_index = header.index('fps')
+
+        for line in file:
+            if max_samples > 0 and num_samples >= max_samples:
                 break
 
-        if max_samples > 0 and num_samples >= max_samples:
-            break
+            if not line.strip():
+                continue
 
-        if line and current_line > 0:
-            fps = parsed_line[fps_index]
+            # We only need to split up to the fps column
+            fps = float(line.split(', ', fps_index + 1)[fps_index])
 
-            total_value += float(fps)
-            min_fps = min(min_fps, float(fps))
-            max_fps = max(max_fps, float(fps))
+            total_value += fps
+            min_fps = min(min_fps, fps)
+            max_fps = max(max_fps, fps)
+            if fps > 0:
+                sketch.add(1000.0 / fps)
             num_samples += 1
 
-        current_line += 1
+    return {'total_value': total_value,
+            'min_fps': min_fps,
+            'max_fps': max_fps,
+            'num_samples': num_samples,
+            'sketch': sketch}
 
-    if (num_samples > 0):
-        avg_fps = total_value / num_samples
+def print_summary(summary):
+    if (summary['num_samples'] > 0):
+        avg_fps = summary['total_value'] / summary['num_samples']
 
         print("avg_fps: ", avg_fps)
-        print("min_fps: ", min_fps)
-        print("max_fps: ", max_fps)
+        print("min_fps: ", summary['min_fps'])
+        print("max_fps: ", summary['max_fps'])
+
+    if summary['sketch'].count > 0:
+        stats = summary['sketch'].get_stats()
+        print("1%_low_fps: ", stats['fps_1_low'])
+        print("0.1%_low_fps: ", stats['fps_0.1_low'])
+        print("p95_frame_time_ms: ", stats['frame_time_p95'])
+        print("p99_frame_time_ms: ", stats['frame_time_p99'])
+        print("stutters: ", stats['stutters'])
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("fps_file", nargs='+', help="fps file (several can be summarized at once)")
+    parser.add_argument("-jobs", nargs='?', type=int, help="max number of files summarized in parallel (default: number of cpus)")
+    parser.add_argument("-max_samples", nargs='?', const=0, type=int, help="max number of samples to use")
+
+    args = parser.parse_args()
+
+    if args.max_samples is not None:
+        max_samples = args.max_samples
+    else:
+        max_samples = -1
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        summaries = list(executor.map(summarize, args.fps_file,
+                                      [max_samples] * len(args.fps_file)))
+
+    for fps_file, summary in zip(args.fps_file, summaries):
+        if len(args.fps_file) > 1:
+            print(f"{fps_file}:")
+        if summary is None:
+            print("'fps' column not found (missing header?)")
+            continue
+        print_summary(summary)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,286 @@
+#
+# fps statistics shared by report-fps-traces.py, run-all-traces.py and
+# fps-summary.py
+#
+import bisect
+import math
+import operator
+import statistics
+
+def discard_min_max(samples):
+    """Discards one min and one max sample, as long as there are at least three samples"""
+    if len(samples) >= 3:
+        return sorted(samples)[1:-1]
+    return samples
+
+def get_avg_sum_squares(samples):
+    """Returns the average and the sum of squared deviations of the samples.
+
+    Computed with floats and C-level sums, as the statistics module
+    functions use exact fractions, and that is too slow with thousands of
+    traces. fps values are small enough for the sum of squares formula to
+    be precise."""
+    avg = math.fsum(samples) / len(samples)
+    sum_squares = math.fsum(map(operator.mul, samples, samples)) - len(samples) * avg * avg
+    return avg, max(sum_squares, 0.0)
+
+def get_avg_std_deviation(samples, skip_min_max=False):
+    """Returns the average and (population) std deviation of the fps samples.
+
+    If skip_min_max, one min and one max sample are discarded first."""
+    if skip_min_max:
+        samples = discard_min_max(samples)
+
+    fps_avg, sum_squares = get_avg_sum_squares(samples)
+    return fps_avg, math.sqrt(sum_squares / len(samples))
+
+def incomplete_beta(a, b, x):
+    """Regularized incomplete beta function I_x(a, b), evaluated with its
+    continued fraction (Lentz's method)"""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    # The continued fraction converges fast for x < (a + 1) / (a + b + 2)
+    if x > (a + 1.0) / (a + b + 2.0):
+        return 1.0 - incomplete_beta(b, a, 1.0 - x)
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log(1.0 - x)) / a
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 200):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * result
+
+def t_cdf(t, df):
+    """Cumulative distribution function of the Student's t distribution"""
+    tail = 0.5 * incomplete_beta(df / 2.0, 0.5, df / (df + t * t))
+    return 1.0 - tail if t > 0 else tail
+
+# Below this number of degrees of freedom the Cornish-Fisher expansion
+# is not precise enough (11% low for df=1 at 97.5%)
+EXACT_T_DF = 5
+
+def t_quantile(p, df):
+    """Returns the p quantile of the Student's t distribution.
+
+    Uses the Cornish-Fisher expansion around the normal quantile, that
+    is accurate to the second decimal for df >= 5, which is more than
+    enough for our confidence intervals, without needing scipy. For
+    fewer degrees of freedom the exact cdf is inverted by bisection."""
+    if df < EXACT_T_DF:
+        low, high = (0.0, 1.0) if p >= 0.5 else (-1.0, 0.0)
+        while (t_cdf(high, df) < p) if p >= 0.5 else (t_cdf(low, df) > p):
+            low, high = (high, high * 2.0) if p >= 0.5 else (low * 2.0, low)
+        for _ in range(100):
+            middle = (low + high) / 2.0
+            if t_cdf(middle, df) < p:
+                low = middle
+            else:
+                high = middle
+            if high - low < 1e-9 * max(1.0, abs(middle)):
+                break
+        return (low + high) / 2.0
+
+    z = statistics.NormalDist().inv_cdf(p)
+    return (z
+            + (z**3 + z) / (4 * df)
+            + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3)
+            + (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / (92160 * df**4))
+
+def get_confidence_interval(samples, confidence=0.95):
+    """Returns the (low, high) confidence interval of the mean fps"""
+    fps_avg, sum_squares = get_avg_sum_squares(samples)
+    if len(samples) < 2:
+        return -math.inf, math.inf
+
+    half_width = (t_quantile(1.0 - (1.0 - confidence) / 2.0, len(samples) - 1)
+                  * math.sqrt(sum_squares / (len(samples) - 1)) / math.sqrt(len(samples)))
+    return fps_avg - half_width, fps_avg + half_width
+
+def get_relative_ci_width(samples, confidence=0.95):
+    """Width of the confidence interval of the mean fps, relative to the mean"""
+    low, high = get_confidence_interval(samples, confidence)
+    fps_avg = statistics.fmean(samples)
+    if fps_avg == 0:
+        return math.inf
+    return (high - low) / fps_avg
+
+def get_relative_change_interval(before, after, confidence=0.95):
+    """Returns the (low, high) confidence interval of the relative change
+    of the mean fps from the before to the after samples.
+
+    Uses Welch's t-test, so the two sets of samples can have different
+    sizes and variances. Returns None if any of them has less than two
+    samples, as then there is no way to know their variance."""
+    if len(before) < 2 or len(after) < 2:
+        return None
+
+    before_avg, before_sum_squares = get_avg_sum_squares(before)
+    after_avg, after_sum_squares = get_avg_sum_squares(after)
+    if before_avg == 0:
+        return None
+    change = (after_avg - before_avg) / before_avg
+
+    before_var = before_sum_squares / (len(before) - 1) / len(before)
+    after_var = after_sum_squares / (len(after) - 1) / len(after)
+    if before_var + after_var == 0:
+        return change, change
+
+    df = (before_var + after_var) ** 2 / (before_var ** 2 / (len(before) - 1) +
+                                          after_var ** 2 / (len(after) - 1))
+    half_width = (t_quantile(1.0 - (1.0 - confidence) / 2.0, df)
+                  * math.sqrt(before_var + after_var) / before_avg)
+    return change - half_width, change + half_width
+
+def get_paired_change_interval(before, after, confidence=0.95):
+    """Returns the (low, high) confidence interval of the relative change
+    of the fps from the before to the after samples, when the samples are
+    paired (the i-th before and after samples were measured one after
+    the other, so they share the same conditions).
+
+    Returns None if there are less than two pairs."""
+    changes = [a / b - 1.0 for b, a in zip(before, after) if b != 0]
+    if len(changes) < 2:
+        return None
+    return get_confidence_interval(changes, confidence)
+
+HELPED = 'helped'
+HURT = 'HURT'
+
+def classify_change(before, after, threshold, confidence=0.95, paired=False):
+    """Returns (HELPED, HURT or None, confidence interval) for the change
+    of the mean fps from the before to the after samples.
+
+    A change is only helped/HURT if its size is at least threshold and
+    its confidence interval excludes zero change. If there are not
+    enough samples to compute the interval, only the threshold is used.
+    If paired, the interval is computed from the paired samples."""
+    before_avg = statistics.fmean(before)
+    after_avg = statistics.fmean(after)
+    if paired:
+        interval = get_paired_change_interval(before, after, confidence)
+    else:
+        interval = get_relative_change_interval(before, after, confidence)
+
+    if before_avg == 0 or abs(after_avg / before_avg - 1.0) < threshold:
+        return None, interval
+    if interval is not None and interval[0] <= 0.0 <= interval[1]:
+        return None, interval
+
+    # Measuring only FPS, higher is always better
+    if after_avg > before_avg:
+        return HELPED, interval
+    return HURT, interval
+
+# A frame taking more than this times the median frame time is counted
+# as a stutter
+STUTTER_FACTOR = 2.0
+
+def get_percentile(sorted_values, percentile):
+    """Nearest-rank percentile of an already sorted sequence"""
+    index = math.ceil(percentile / 100.0 * len(sorted_values)) - 1
+    return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+def get_low_fps(sorted_frame_times, fraction):
+    """Average fps of the slowest fraction of the frames (ie: 1% lows)"""
+    count = max(1, int(len(sorted_frame_times) * fraction))
+    return 1000.0 / statistics.fmean(sorted_frame_times[-count:])
+
+def get_frame_time_stats(frame_times):
+    """Returns the frame pacing stats of a sequence of frame times (ms)
+
+    The frame times are sorted once, and all the stats are taken from
+    slices of the sorted sequence."""
+    sorted_frame_times = sorted(frame_times)
+    median = get_percentile(sorted_frame_times, 50)
+    stutter_threshold = median * STUTTER_FACTOR
+
+    stats = {}
+    stats['fps_avg'] = 1000.0 / statistics.fmean(sorted_frame_times)
+    stats['fps_1_low'] = get_low_fps(sorted_frame_times, 0.01)
+    stats['fps_0.1_low'] = get_low_fps(sorted_frame_times, 0.001)
+    stats['frame_time_p95'] = get_percentile(sorted_frame_times, 95)
+    stats['frame_time_p99'] = get_percentile(sorted_frame_times, 99)
+    # Number of frames over the threshold, found with a binary search
+    # on the sorted frame times
+    stats['stutters'] = len(sorted_frame_times) - bisect.bisect_right(sorted_frame_times, stutter_threshold)
+    return stats
+
+class FrameTimeSketch:
+    """Constant-memory approximation of get_frame_time_stats()
+
+    Frame times are counted on logarithmic buckets (like DDSketch), so
+    any frame time is known with a relative error of relative_accuracy,
+    and the number of buckets only depends on the range of the frame
+    times, not on the number of frames. Sketches of several logs can be
+    merged."""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, frame_time):
+        index = math.ceil(math.log(frame_time) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += frame_time
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+
+    def get_value(self, index):
+        return 2.0 * self.gamma ** index / (self.gamma + 1.0)
+
+    def get_percentile(self, percentile):
+        rank = max(math.ceil(percentile / 100.0 * self.count), 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return self.get_value(index)
+        return self.get_value(max(self.buckets))
+
+    def get_low_fps(self, fraction):
+        remaining = max(1, int(self.count * fraction))
+        wanted = remaining
+        total = 0.0
+        for index in sorted(self.buckets, reverse=True):
+            taken = min(self.buckets[index], remaining)
+            total += taken * self.get_value(index)
+            remaining -= taken
+            if remaining == 0:
+                break
+        return 1000.0 * wanted / total
+
+    def get_stats(self):
+        stutter_threshold = self.get_percentile(50) * STUTTER_FACTOR
+
+        stats = {}
+        stats['fps_avg'] = 1000.0 * self.count / self.total
+        stats['fps_1_low'] = self.get_low_fps(0.01)
+        stats['fps_0.1_low'] = self.get_low_fps(0.001)
+        stats['frame_time_p95'] = self.get_percentile(95)
+        stats['frame_time_p99'] = self.get_percentile(99)
+        stats['stutters'] = sum(count for index, count in self.buckets.items()
+                                if self.get_value(index) > stutter_threshold)
+        return stats
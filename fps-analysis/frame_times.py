@@ -0,0 +1,75 @@
+#
+# Per-frame frame times captured by run-all-traces.py.
+#
+# The frame times come from the VK_LAYER_MESA_overlay output_file. With
+# fps_sampling_period=0 the overlay writes one row per frame, so the fps
+# column of each row is the inverse of that frame time.
+#
+# The frame times of each sample are stored on a binary sidecar, next to
+# the fps file, as a raw array of 32-bit floats (in milliseconds), one
+# file per trace sample:
+#
+#   results/fps-stats-<date>.txt
+#   results/frame-times-<date>/<trace>.<sample>.f32
+#
+# With interleaved commits the commit is part of the name
+# (<trace>.<commit>.<sample>.f32).
+#
+from array import array
+import os
+
+FRAME_TIMES_SUFFIX = '.f32'
+
+def get_overlay_env(output_file):
+    env = dict(os.environ)
+    env['VK_INSTANCE_LAYERS'] = 'VK_LAYER_MESA_overlay'
+    env['VK_LAYER_MESA_OVERLAY_CONFIG'] = f"output_file={output_file},fps_sampling_period=0,no_display,fps"
+    return env
+
+def read_overlay_frame_times(filename):
+    """Returns the frame times (ms) of a VK_LAYER_MESA_overlay output file"""
+    frame_times = array('f')
+    with open(filename) as file_obj:
+        header = file_obj.readline().rstrip('\n').split(', ')
+        if 'fps' not in header:
+            return frame_times
+        fps_index = header.index('fps')
+        for line in file_obj:
+            fields = line.split(', ')
+            if len(fields) <= fps_index:
+                continue
+            fps = float(fields[fps_index])
+            if fps > 0:
+                frame_times.append(1000.0 / fps)
+    return frame_times
+
+def get_directory(fps_file_name):
+    """Returns the frame times sidecar directory of a fps file"""
+    directory, basename = os.path.split(fps_file_name)
+    basename = os.path.splitext(basename)[0].replace('fps-stats-', 'frame-times-', 1)
+    return os.path.join(directory, basename)
+
+def write(directory, trace, sample, frame_times, tag=None):
+    os.makedirs(directory, exist_ok=True)
+    name = trace if tag is None else f"{trace}.{tag}"
+    with open(os.path.join(directory, f"{name}.{sample}{FRAME_TIMES_SUFFIX}"), 'wb') as file_obj:
+        frame_times.tofile(file_obj)
+
+def read_all(directory, tag=None):
+    """Returns a dict with the frame times of all the samples of each trace"""
+    results = {}
+    if not os.path.isdir(directory):
+        return results
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(FRAME_TIMES_SUFFIX):
+            continue
+        trace = filename[:-len(FRAME_TIMES_SUFFIX)].rsplit('.', 1)[0]
+        if tag is not None:
+            if not trace.endswith('.' + tag):
+                continue
+            trace = trace[:-len(tag) - 1]
+        frame_times = array('f')
+        with open(os.path.join(directory, filename), 'rb') as file_obj:
+            frame_times.frombytes(file_obj.read())
+        results.setdefault(trace, array('f')).extend(frame_times)
+    return results
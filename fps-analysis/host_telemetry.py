@@ -0,0 +1,205 @@
+#
+# Host telemetry recorded by run-all-traces.py with each fps sample, so
+# samples measured under abnormal conditions (throttled or busy cpus,
+# hot system) can be told apart by report-fps-traces.py.
+#
+# A snapshot is taken before and after each replay. Only a few small
+# /proc and /sys files are read, so it is negligible next to a replay.
+# Values not available on the host (ie: no cpufreq or thermal zones on
+# a VM) are None.
+#
+# The resource usage of the replay is measured by a small wrapper
+# process, as its only child, so other children of run-all-traces.py
+# (ie: the mesa builds of --build-ahead, or the trace staging copies)
+# are not accounted to the replay.
+#
+import csv
+import functools
+import glob
+import json
+import os
+import statistics
+import sys
+
+# The telemetry of a sample
+FIELDS = [
+    'loadavg',          # 1 minute load average before the replay
+    'cpu_mhz',          # average cpu frequency after the replay
+    'temp_max',         # hottest thermal zone after the replay, in C
+    'throttle_count',   # cpu thermal throttling events during the replay
+    'user_time',        # cpu time of the replay, in seconds
+    'sys_time',
+    'major_faults',     # page faults that needed I/O (ie: trace reads)
+    'involuntary_switches',
+]
+
+@functools.cache
+def get_cpu_frequency_files():
+    return sorted(glob.glob('/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq'))
+
+@functools.cache
+def get_thermal_files():
+    return sorted(glob.glob('/sys/class/thermal/thermal_zone*/temp'))
+
+@functools.cache
+def get_throttle_files():
+    return sorted(glob.glob('/sys/devices/system/cpu/cpu[0-9]*/thermal_throttle/core_throttle_count'))
+
+def read_values(files):
+    values = []
+    for path in files:
+        try:
+            with open(path) as file_obj:
+                values.append(int(file_obj.read()))
+        except (OSError, ValueError):
+            pass
+    return values
+
+def read_loadavg():
+    try:
+        with open('/proc/loadavg') as file_obj:
+            return float(file_obj.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def snapshot():
+    """Returns the host state, to compute the telemetry of a replay
+    from the snapshots before and after it"""
+    return {
+        'loadavg': read_loadavg(),
+        'cpu_khz': read_values(get_cpu_frequency_files()),
+        'temp': read_values(get_thermal_files()),
+        'throttle': read_values(get_throttle_files()),
+    }
+
+# Runs the command (argv[2:]) as its only child, so RUSAGE_CHILDREN is
+# the usage of the command, and writes it as json on argv[1]. Exits
+# with the status of the command. SIGTERM and SIGINT are forwarded to
+# the command, so it doesn't outlive the wrapper.
+RUSAGE_WRAPPER = """
+import json, resource, signal, subprocess, sys
+process = subprocess.Popen(sys.argv[2:])
+for signum in (signal.SIGTERM, signal.SIGINT):
+    signal.signal(signum, lambda signum, frame: process.send_signal(signum))
+status = process.wait()
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+with open(sys.argv[1], 'w') as file_obj:
+    json.dump({'user_time': round(usage.ru_utime, 3), 'sys_time': round(usage.ru_stime, 3),
+               'major_faults': usage.ru_majflt, 'involuntary_switches': usage.ru_nivcsw}, file_obj)
+sys.exit(status if status >= 0 else 128 - status)
+"""
+
+def get_rusage_command(rusage_file, command):
+    """Returns the command wrapped to write its resource usage on
+    rusage_file"""
+    return [sys.executable, '-c', RUSAGE_WRAPPER, rusage_file] + command
+
+def read_rusage(rusage_file):
+    """Returns the resource usage written by the wrapped command, or None
+    if it wasn't written"""
+    try:
+        with open(rusage_file) as file_obj:
+            return json.load(file_obj)
+    except (OSError, ValueError):
+        return None
+
+def get_telemetry(before, after, rusage):
+    """Returns the telemetry of the replay run between the snapshots,
+    with the resource usage of the replay (read_rusage)"""
+    telemetry = {
+        'loadavg': before['loadavg'],
+        'cpu_mhz': None,
+        'temp_max': None,
+        'throttle_count': None,
+        'user_time': None,
+        'sys_time': None,
+        'major_faults': None,
+        'involuntary_switches': None,
+    }
+    if rusage is not None:
+        for field in ['user_time', 'sys_time', 'major_faults', 'involuntary_switches']:
+            telemetry[field] = rusage[field]
+    if after['cpu_khz']:
+        telemetry['cpu_mhz'] = round(statistics.fmean(after['cpu_khz']) / 1000.0)
+    if after['temp']:
+        telemetry['temp_max'] = max(after['temp']) / 1000.0
+    if before['throttle'] and len(before['throttle']) == len(after['throttle']):
+        telemetry['throttle_count'] = sum(after['throttle']) - sum(before['throttle'])
+    return telemetry
+
+def parse(values):
+    """Telemetry from its string values (ie: read from a csv file)"""
+    telemetry = {}
+    for field in FIELDS:
+        value = values.get(field)
+        telemetry[field] = float(value) if value not in (None, '') else None
+    return telemetry
+
+def get_reference(telemetries):
+    """The median of each field over the telemetry of all the samples of
+    a run, that the abnormal samples are compared against"""
+    reference = {}
+    for field in FIELDS:
+        values = [t[field] for t in telemetries if t is not None and t[field] is not None]
+        reference[field] = statistics.median(values) if values else None
+    return reference
+
+def get_abnormal_reasons(telemetry, reference, max_extra_load, max_temp, min_cpu_mhz_ratio):
+    """Returns why the sample was measured under abnormal conditions
+    (an empty list if it wasn't)"""
+    reasons = []
+    if telemetry is None:
+        return reasons
+    if telemetry['throttle_count']:
+        reasons.append(f"{telemetry['throttle_count']:.0f} throttling events")
+    if telemetry['temp_max'] is not None and telemetry['temp_max'] > max_temp:
+        reasons.append(f"temperature {telemetry['temp_max']:.1f}C")
+    if (telemetry['loadavg'] is not None and reference['loadavg'] is not None and
+            telemetry['loadavg'] > reference['loadavg'] + max_extra_load):
+        reasons.append(f"load average {telemetry['loadavg']:.2f} (usual {reference['loadavg']:.2f})")
+    if (telemetry['cpu_mhz'] is not None and reference['cpu_mhz'] and
+            telemetry['cpu_mhz'] < reference['cpu_mhz'] * min_cpu_mhz_ratio):
+        reasons.append(f"cpu frequency {telemetry['cpu_mhz']:.0f}MHz (usual {reference['cpu_mhz']:.0f}MHz)")
+    return reasons
+
+# The telemetry of the samples on a fps file is stored on a csv file
+# next to it, on the same order as the samples:
+#
+#   results/fps-stats-<date>.txt
+#   results/telemetry-<date>.csv
+#
+# The tag column is the commit of the sample on the interleaved runs.
+def get_file_name(fps_file_name):
+    directory, name = os.path.split(fps_file_name)
+    return os.path.join(directory, 'telemetry-' + os.path.splitext(name.replace('fps-stats-', '', 1))[0] + '.csv')
+
+def write(file_name, trace, sample, tag, telemetry):
+    new_file = not os.path.exists(file_name)
+    with open(file_name, 'a') as file_obj:
+        if new_file:
+            file_obj.write(','.join(['trace', 'tag', 'sample'] + FIELDS) + '\n')
+        values = [trace, tag or '', str(sample)]
+        values += ['' if telemetry[field] is None else str(telemetry[field]) for field in FIELDS]
+        file_obj.write(','.join(values) + '\n')
+
+def read(file_name, tag=None):
+    """Returns a dict with the list of telemetries of each trace, on the
+    order of its samples on the fps file"""
+    telemetries = {}
+    with open(file_name, newline='') as file_obj:
+        for row in csv.DictReader(file_obj):
+            if tag is not None and row['tag'] != tag:
+                continue
+            telemetries.setdefault(row['trace'], []).append(parse(row))
+    return telemetries
+
+def read_by_sample(file_name, tag=None):
+    """Returns a dict with the telemetry of each sample index of each
+    trace"""
+    telemetries = {}
+    with open(file_name, newline='') as file_obj:
+        for row in csv.DictReader(file_obj):
+            if tag is not None and row['tag'] != tag:
+                continue
+            telemetries.setdefault(row['trace'], {})[int(row['sample'])] = parse(row)
+    return telemetries
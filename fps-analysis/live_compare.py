@@ -0,0 +1,64 @@
+#
+# Live comparison of the samples measured by run-all-traces.py against
+# a reference result set, so regressions are known while the sweep is
+# still running, instead of after running report-fps-traces.py.
+#
+# Each new sample updates the helped/HURT status of its trace, with the
+# same criteria as report-fps-traces.py (fps_stats.classify_change). A
+# trace is only flagged once its confidence interval is known, so once
+# there are at least two samples on both sides.
+#
+from datetime import datetime
+
+import fps_stats
+
+def get_change_string(before, after):
+    before_avg = fps_stats.get_avg_std_deviation(before)[0]
+    after_avg = fps_stats.get_avg_std_deviation(after)[0]
+    return f"{before_avg:.2f} -> {after_avg:.2f} ({(after_avg / before_avg - 1.0) * 100:.2f}%)"
+
+class LiveComparison:
+    """Compares the samples of a run, as they are measured, with the
+    reference samples (a dict with the samples of each trace)"""
+
+    def __init__(self, name, reference, threshold, confidence, warnings_file=None):
+        self.name = name
+        self.reference = reference
+        self.threshold = threshold
+        self.confidence = confidence
+        self.warnings_file = warnings_file
+        self.samples = {}
+        self.status = {}
+
+    def warn(self, message):
+        print(message)
+        if self.warnings_file is not None:
+            with open(self.warnings_file, 'a') as file_obj:
+                file_obj.write(f"{datetime.now().isoformat(timespec='seconds')} {message}\n")
+
+    def add_sample(self, trace, fps):
+        samples = self.samples.setdefault(trace, [])
+        samples.append(fps)
+        reference = self.reference.get(trace)
+        if not reference:
+            return
+
+        status, interval = fps_stats.classify_change(reference, samples, self.threshold, self.confidence)
+        if interval is None:
+            return
+        if status != self.status.get(trace):
+            if status is not None:
+                self.warn(f"LIVE {status}: {self.name}: {trace}: {get_change_string(reference, samples)} "
+                          f"[{interval[0] * 100:.2f}%, {interval[1] * 100:.2f}%] after {len(samples)} samples")
+            else:
+                self.warn(f"LIVE no longer {self.status[trace]}: {self.name}: {trace}: "
+                          f"{get_change_string(reference, samples)}")
+        self.status[trace] = status
+
+    def get_traces(self, status):
+        return sorted(trace for trace, trace_status in self.status.items() if trace_status == status)
+
+    def print_summary(self):
+        print(f"LIVE {self.name}: helped: {len(self.get_traces(fps_stats.HELPED))}, "
+              f"HURT: {len(self.get_traces(fps_stats.HURT))}, "
+              f"compared: {sum(1 for trace in self.samples if trace in self.reference)}")
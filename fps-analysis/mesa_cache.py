@@ -0,0 +1,159 @@
+#
+# Cache of mesa installs for run-all-traces.py.
+#
+# Each mesa commit is built (with meson, on its own git worktree) and
+# installed on its own prefix, keyed by the commit hash and the build
+# options, so later sweeps can reuse it instead of rebuilding. The
+# replays are pointed to the prefix through the loader environment
+# variables.
+#
+# The cache is size-bounded: when it is over its maximum size the
+# least recently used installs are removed.
+#
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+INFO_FILE = 'mesa-cache-info.json'
+
+def get_key(mesa_commit, build_options):
+    return hashlib.sha256((mesa_commit + '\n' + build_options).encode('utf-8')).hexdigest()[:16]
+
+def get_prefix(cache_directory, mesa_commit, build_options):
+    # Absolute, as meson writes it on the installed files (ie: the
+    # library_path of the vulkan ICD jsons)
+    return os.path.join(os.path.abspath(cache_directory), get_key(mesa_commit, build_options))
+
+def lookup(cache_directory, mesa_commit, build_options):
+    """Returns the prefix of the cached install, or None if not cached"""
+    prefix = get_prefix(cache_directory, mesa_commit, build_options)
+    info_file = os.path.join(prefix, INFO_FILE)
+    if not os.path.exists(info_file):
+        return None
+    # The mtime of the info file is what the LRU eviction uses
+    os.utime(info_file)
+    return prefix
+
+def get_directory_size(directory):
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            path = os.path.join(root, f)
+            if not os.path.islink(path):
+                size += os.path.getsize(path)
+    return size
+
+def format_cpu_list(cpus):
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+def build(cache_directory, mesa_directory, mesa_commit, build_options, verbose=False, env=None, cpus=None):
+    """Builds and installs mesa_commit on its cache prefix, returning it.
+
+    The build is done on a temporary git worktree, so the mesa
+    directory is not touched, and several commits can be built at the
+    same time. The install is only visible on the cache once it is
+    complete. If cpus is provided, the build only runs on those cpus.
+
+    mesa is configured with the final prefix, as the installed files
+    point to it, but installed on a staging DESTDIR, that is moved to the
+    prefix once the install is complete."""
+    prefix = get_prefix(cache_directory, mesa_commit, build_options)
+    stage_directory = prefix + '.tmp'
+    staged_prefix = stage_directory + prefix
+    worktree = tempfile.mkdtemp(prefix='mesa-worktree-')
+    build_directory = os.path.join(worktree, 'build')
+    stdout = None if verbose else subprocess.DEVNULL
+
+    taskset = []
+    ninja_jobs = []
+    if cpus is not None:
+        taskset = ['taskset', '-c', format_cpu_list(cpus)]
+        ninja_jobs = ['-j', str(len(cpus))]
+
+    install_env = dict(env if env is not None else os.environ, DESTDIR=stage_directory)
+
+    shutil.rmtree(stage_directory, ignore_errors=True)
+    try:
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree, mesa_commit],
+                       cwd=mesa_directory, check=True, stdout=stdout, env=env)
+        subprocess.run(taskset + ['meson', 'setup', build_directory, worktree,
+                        '--prefix', prefix, '--libdir', 'lib'] + build_options.split(),
+                       check=True, stdout=stdout, env=env)
+        subprocess.run(taskset + ['ninja', '-C', build_directory, 'install'] + ninja_jobs,
+                       check=True, stdout=stdout, env=install_env)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree],
+                       cwd=mesa_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+    info = {
+        'mesa_commit': mesa_commit,
+        'build_options': build_options,
+        'size': get_directory_size(staged_prefix),
+        'build_date': time.strftime("%Y-%m-%d_%H:%M:%S"),
+    }
+    with open(os.path.join(staged_prefix, INFO_FILE), 'w') as info_file:
+        json.dump(info, info_file)
+
+    shutil.rmtree(prefix, ignore_errors=True)
+    os.rename(staged_prefix, prefix)
+    shutil.rmtree(stage_directory, ignore_errors=True)
+    return prefix
+
+def evict(cache_directory, max_size, keep=()):
+    """Removes the least recently used installs until the cache is not
+    bigger than max_size bytes. The prefixes on keep are never removed."""
+    entries = []
+    total_size = 0
+    for info_file in glob.glob(os.path.join(cache_directory, '*', INFO_FILE)):
+        with open(info_file) as file_obj:
+            size = json.load(file_obj)['size']
+        entries.append((os.path.getmtime(info_file), os.path.dirname(info_file), size))
+        total_size += size
+
+    entries.sort()
+    for mtime, prefix, size in entries:
+        if total_size <= max_size:
+            break
+        if prefix in keep:
+            continue
+        shutil.rmtree(prefix, ignore_errors=True)
+        total_size -= size
+    return total_size
+
+def get_loader_env(prefix):
+    """Environment variables to use the mesa install on prefix"""
+    lib_directory = os.path.join(prefix, 'lib')
+    env = {}
+    env['LD_LIBRARY_PATH'] = lib_directory
+    if os.environ.get('LD_LIBRARY_PATH'):
+        env['LD_LIBRARY_PATH'] += ':' + os.environ['LD_LIBRARY_PATH']
+    env['LIBGL_DRIVERS_PATH'] = os.path.join(lib_directory, 'dri')
+    env['__EGL_VENDOR_LIBRARY_DIRS'] = os.path.join(prefix, 'share', 'glvnd', 'egl_vendor.d')
+    icd_files = sorted(glob.glob(os.path.join(prefix, 'share', 'vulkan', 'icd.d', '*.json')))
+    if icd_files:
+        env['VK_ICD_FILENAMES'] = ':'.join(icd_files)
+        env['VK_DRIVER_FILES'] = env['VK_ICD_FILENAMES']
+    return env
+
+@contextlib.contextmanager
+def loader_env(prefix):
+    """Points the process environment (so the replays) to the mesa
+    install on prefix, restoring it on exit"""
+    env = get_loader_env(prefix)
+    old_env = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
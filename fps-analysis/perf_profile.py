@@ -0,0 +1,74 @@
+#
+# perf captures of the replays done by run-all-traces.py --profile.
+#
+# The profiled replay of a trace is wrapped with perf stat (counters)
+# or perf record (sampling profile), and its output stored on a
+# sidecar directory next to the fps file:
+#
+#   results/fps-stats-<date>.txt
+#   results/profile-<date>/<trace>.perf-stat.csv
+#   results/profile-<date>/<trace>.perf.data
+#
+# With interleaved commits the commit is part of the name
+# (<trace>.<commit>.perf-stat.csv).
+#
+import os
+
+STAT = 'stat'
+RECORD = 'record'
+STAT_SUFFIX = '.perf-stat.csv'
+RECORD_SUFFIX = '.perf.data'
+
+def get_directory(fps_file_name):
+    """Returns the profile sidecar directory of a fps file"""
+    directory, basename = os.path.split(fps_file_name)
+    basename = os.path.splitext(basename)[0].replace('fps-stats-', 'profile-', 1)
+    return os.path.join(directory, basename)
+
+def get_output_file(directory, trace, mode, tag=None):
+    name = trace if tag is None else f"{trace}.{tag}"
+    return os.path.join(directory, name + (STAT_SUFFIX if mode == STAT else RECORD_SUFFIX))
+
+def get_command(mode, output_file, events=None):
+    """Returns the perf command the replay command is appended to"""
+    if mode == STAT:
+        command = ['perf', 'stat', '-x', ',', '-o', output_file]
+        if events:
+            command += ['-e', events]
+    else:
+        command = ['perf', 'record', '-g', '-o', output_file]
+    return command + ['--']
+
+def read_stat(filename):
+    """Returns a dict with the value of each counter of a perf stat -x,
+    output file. Counters not supported or not counted are skipped."""
+    counters = {}
+    with open(filename) as file_obj:
+        for line in file_obj:
+            if not line.strip() or line.startswith('#'):
+                continue
+            # value,unit,event,run time,percentage,...
+            fields = line.rstrip('\n').split(',')
+            if len(fields) < 3:
+                continue
+            try:
+                counters[fields[2]] = float(fields[0])
+            except ValueError:
+                pass
+    return counters
+
+def read_all(directory, tag=None):
+    """Returns a dict with the counters of each trace"""
+    results = {}
+    if not os.path.isdir(directory):
+        return results
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(STAT_SUFFIX):
+            continue
+        name = filename[:-len(STAT_SUFFIX)]
+        if tag is not None:
+            if not name.endswith('.' + tag):
+                continue
+            name = name[:-len(tag) - 1]
+        results[name] = read_stat(os.path.join(directory, filename))
+    return results
@@ -6,7 +6,12 @@ import math
 import csv
 import pathlib
 import sys
-import statistics
+
+import fps_stats
+import frame_times
+import host_telemetry
+import perf_profile
+import results_store
 
 def format_percent(frac):
     """Converts a factional value (typically 0.0 to 1.0) to a string as a percentage"""
@@ -44,70 +49,247 @@ def change_with_std_deviation(b, a):
     return get_avg_std_deviation_string(b) + " -> " + get_avg_std_deviation_string(a) + get_delta(b[0], a[0])
 
 
-def get_result_string(p, b, a, args):
+def get_interval_string(interval):
+    if interval is None:
+        return ''
+    return ' [{}, {}]'.format(format_percent(interval[0]), format_percent(interval[1]))
+
+
+def get_result_string(p, b, a, args, interval=None):
     p = p + ": "
     while len(p) < 50:
         p = p + ' '
     if (args.show_std_deviation):
-        return p + change_with_std_deviation(b, a)
+        result = p + change_with_std_deviation(b, a)
     else:
-        return p + change(b[0], a[0])
-
-
-def get_results(filename, include_filter, exclude_filter):
-    results = {}
-
-    # Each line has the format "trace_name,fps", and can be more that one trace_name entry
+        result = p + change(b[0], a[0])
+    if (args.show_confidence_interval):
+        result += get_interval_string(interval)
+    return result
+
+
+def get_store_key(path, commit, args):
+    """Returns the stored (mesa commit, replay options) matching commit"""
+    commits = results_store.find_commits(path, commit)
+    if len(commits) != 1:
+        print(f"Commit {commit} matches {len(commits)} commits on {path}")
+        sys.exit(1)
+
+    replay_options = results_store.find_replay_options(path, commits[0])
+    if args.replay_options is not None:
+        if args.replay_options not in replay_options:
+            print(f"No samples for commit {commit} with replay options '{args.replay_options}'")
+            sys.exit(1)
+        replay_options = [args.replay_options]
+    elif len(replay_options) > 1:
+        print(f"Commit {commit} was measured with several replay options, use --replay-options to choose one of: {replay_options}")
+        sys.exit(1)
+
+    return commits[0], replay_options[0]
+
+def get_store_results(path, commit, args, include_filter, exclude_filter):
+    samples = results_store.load_samples(path, *get_store_key(path, commit, args))
+    return results_store.filter_samples(samples, include_filter, exclude_filter)
+
+def read_interleaved_rows(filename):
+    # Each line has the format "trace_name,fps,commit,sample", as written
+    # by run-all-traces.py --interleave
     with open(filename) as file_obj:
-        reader_obj = csv.reader(file_obj)
-        for row in reader_obj:
-            # We assume that if not include filter is provided, we want to process all of them
-            if include_filter and not any(r.search(row[0]) for r in include_filter):
-                    continue
-
-            if any(r.search(row[0]) for r in exclude_filter):
-                continue
-
-            if row[0] in results:
-                result_list = results[row[0]]
-            else:
-                result_list = []
-
-            result_list.append(float(row[1]))
-            results[row[0]] = result_list
-
+        return [row for row in csv.reader(file_obj) if len(row) >= 4]
+
+def get_interleaved_commit(rows, commit, filename):
+    commits = set(row[2] for row in rows if row[2].startswith(commit))
+    if len(commits) != 1:
+        print(f"Commit {commit} matches {len(commits)} commits on {filename}")
+        sys.exit(1)
+    return commits.pop()
+
+def get_interleaved_results(filename, before, after, include_filter, exclude_filter):
+    """Returns the before and after samples of each trace, paired: the
+    i-th samples of both commits were measured on the same round (sample
+    index). The rounds missing the sample of one of the commits (failed
+    or timed out replays) are dropped. Also returns the sample indices
+    of the pairs of each trace."""
+    rows = read_interleaved_rows(filename)
+    before = get_interleaved_commit(rows, before, filename)
+    after = get_interleaved_commit(rows, after, filename)
+
+    rounds = {}
+    for row in rows:
+        if row[2] in (before, after) and row[1] != results_store.TIMEOUT_STATUS:
+            rounds.setdefault(row[0], {}).setdefault(int(row[3]), {})[row[2]] = row[1]
+
+    before_rows = []
+    after_rows = []
+    samples = {}
+    for trace, trace_rounds in rounds.items():
+        for sample in sorted(trace_rounds):
+            values = trace_rounds[sample]
+            if before in values and after in values:
+                before_rows.append((trace, values[before]))
+                after_rows.append((trace, values[after]))
+                samples.setdefault(trace, []).append(sample)
+    return (results_store.filter_samples(before_rows, include_filter, exclude_filter),
+            results_store.filter_samples(after_rows, include_filter, exclude_filter),
+            samples)
+
+def get_telemetry(source, args, samples=None):
+    """Returns the host telemetry of the samples of source (a fps file,
+    or a mesa commit with --results-db or --interleaved). With
+    --interleaved, the telemetry of the sample indices of each trace on
+    samples."""
+    if args.results_db is not None:
+        return results_store.load_telemetry(args.results_db, *get_store_key(args.results_db, source, args))
+
+    if args.interleaved is not None:
+        tag = get_interleaved_commit(read_interleaved_rows(args.interleaved), source, args.interleaved)
+        telemetry_file = host_telemetry.get_file_name(args.interleaved)
+        if not pathlib.Path(telemetry_file).exists():
+            return {}
+        by_sample = host_telemetry.read_by_sample(telemetry_file, tag)
+        return {p: [by_sample[p].get(sample) for sample in indices]
+                for p, indices in samples.items() if p in by_sample}
+    else:
+        tag = None
+        telemetry_file = host_telemetry.get_file_name(source)
+    if not pathlib.Path(telemetry_file).exists():
+        return {}
+    return host_telemetry.read(telemetry_file, tag)
+
+def get_abnormal_samples(source, raw, args, samples=None):
+    """Returns the index of the samples of each trace measured under
+    abnormal host conditions, printing them unless --summary-only"""
+    telemetries = get_telemetry(source, args, samples)
+    reference = host_telemetry.get_reference([t for p in raw for t in telemetries.get(p, [])])
+
+    abnormal = {}
+    for p in sorted(raw):
+        # Without telemetry for all the samples they can't be matched
+        if len(telemetries.get(p, [])) != len(raw[p]):
+            continue
+        for i, telemetry in enumerate(telemetries[p]):
+            reasons = host_telemetry.get_abnormal_reasons(telemetry, reference, args.max_extra_load,
+                                                          args.max_temp, args.min_cpu_mhz_ratio)
+            if reasons:
+                abnormal.setdefault(p, []).append(i)
+                if not args.summary_only:
+                    print(f"ABNORMAL: {source}: {p} sample {i}: {', '.join(reasons)}")
+    return abnormal
+
+def drop_samples(raw, abnormal):
+    results = {}
+    for p, values in raw.items():
+        dropped = set(abnormal.get(p, []))
+        values = [v for i, v in enumerate(values) if i not in dropped]
+        if values:
+            results[p] = values
     return results
 
 def process_results(raw, args):
     results = {}
 
     for key in raw:
-        fps_min = min(raw[key])
-        fps_max = max(raw[key])
-
-        if args.skip_min_max and len(raw[key]) >= 3:
-            raw[key].remove(fps_min)
-            raw[key].remove(fps_max)
-
-        fps_avg = statistics.mean(raw[key])
-        std_deviation = statistics.pstdev(raw[key], fps_avg)
+        samples = raw[key]
+        if args.skip_min_max:
+            samples = fps_stats.discard_min_max(samples)
+        fps_avg, std_deviation = fps_stats.get_avg_std_deviation(samples)
 
         result_group = {}
         result_group['fps_avg'] = [ fps_avg, std_deviation ]
+        # Kept for the confidence intervals
+        result_group['samples'] = samples
         results[key] = result_group
 
     return results
 
 
+def get_frame_times(source, args):
+    """Returns the frame times of each trace of source (a fps file, or a
+    mesa commit with --interleaved)"""
+    if args.interleaved is not None:
+        tag = get_interleaved_commit(read_interleaved_rows(args.interleaved), source, args.interleaved)
+        return frame_times.read_all(frame_times.get_directory(args.interleaved), tag)
+    return frame_times.read_all(frame_times.get_directory(source))
+
+def print_frame_time_changes(args, include_filter, exclude_filter):
+    """Prints the frame pacing stats of the traces with frame times captured
+    by run-all-traces.py --frame-times on both runs"""
+    before = get_frame_times(args.before, args)
+    after = get_frame_times(args.after, args)
+
+    printed = False
+    for p in sorted(before):
+        if p not in after:
+            continue
+        if include_filter and not any(r.search(p) for r in include_filter):
+            continue
+        if any(r.search(p) for r in exclude_filter):
+            continue
+
+        before_stats = fps_stats.get_frame_time_stats(before[p])
+        after_stats = fps_stats.get_frame_time_stats(after[p])
+        for stat in before_stats:
+            name = stat + ": " + p + ": "
+            while len(name) < 60:
+                name = name + ' '
+            print(name + change(before_stats[stat], after_stats[stat]))
+        printed = True
+
+    if printed:
+        print("")
+
+
+def get_counters(source, args):
+    """Returns the perf counters of the traces of source (a fps file, or
+    a mesa commit with --results-db or --interleaved) profiled by
+    run-all-traces.py --profile stat"""
+    if args.results_db is not None:
+        return results_store.load_counters(args.results_db, *get_store_key(args.results_db, source, args))
+    if args.interleaved is not None:
+        tag = get_interleaved_commit(read_interleaved_rows(args.interleaved), source, args.interleaved)
+        return perf_profile.read_all(perf_profile.get_directory(args.interleaved), tag)
+    return perf_profile.read_all(perf_profile.get_directory(source))
+
+
+def print_counter_changes(before_counters, after_counters, traces):
+    """Prints the perf counter changes of the traces profiled on both runs"""
+    printed = False
+    for p in traces:
+        if p not in before_counters or p not in after_counters:
+            continue
+        for counter in sorted(before_counters[p]):
+            if counter not in after_counters[p]:
+                continue
+            name = counter + ": " + p + ": "
+            while len(name) < 60:
+                name = name + ' '
+            print(name + change(before_counters[p][counter], after_counters[p][counter]))
+        printed = True
+
+    if printed:
+        print("")
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("before", help="The output of the original code")
-    parser.add_argument("after", help="The output of the new code")
+    parser.add_argument("before", help="The output of the original code (a mesa commit if --results-db is used)")
+    parser.add_argument("after", help="The output of the new code (a mesa commit if --results-db is used)")
     parser.add_argument("--summary-only", "-s", action="store_true", default=False,
                         help="Do not show the trace helped / hurt data")
+    parser.add_argument("--abnormal-samples", choices=['flag', 'drop'], help="Show (flag) or also discard (drop) the samples measured under abnormal host conditions, from the telemetry recorded by run-all-traces.py")
+    parser.add_argument("--confidence", default=0.95, type=float, help="Confidence level of the interval of the fps change used to determine helped/HURT runs (default 0.95)")
+    parser.add_argument("--counters", action="store_true", help="Show the perf counter changes of the helped/HURT traces profiled with run-all-traces.py --profile stat")
+    parser.add_argument("--frame-times", action="store_true", help="Show the frame pacing stats (1%%/0.1%% lows, p95/p99 frame times, stutters) of the traces run with run-all-traces.py --frame-times")
+    parser.add_argument("--interleaved", metavar="FPS_FILE", help="Read the samples of the before/after mesa commits from a run-all-traces.py --interleave fps file, and compare them as paired samples")
+    parser.add_argument("--max-extra-load", default=1.0, type=float, help="With --abnormal-samples, load average over the usual one of the run considered abnormal (default 1.0)")
+    parser.add_argument("--max-temp", default=90.0, type=float, help="With --abnormal-samples, temperature in C considered abnormal (default 90)")
+    parser.add_argument("--min-cpu-mhz-ratio", default=0.9, type=float, help="With --abnormal-samples, ratio of the usual cpu frequency of the run below which it is considered abnormal (default 0.9)")
+    parser.add_argument("--results-db", help="Read the samples of the before/after mesa commits from the run-all-traces.py results store")
+    parser.add_argument("--replay-options", help="Replay options of the samples read from the results store. Only needed if the commits were measured with several replay options")
     parser.add_argument("--skip-gfxrecon", action="store_true", help="If we should skip gfxreconstruct traces")
     parser.add_argument("--skip-apitrace", action="store_true", help="If we should skip apitrace traces")
     parser.add_argument("--skip-min-max", action="store_true", help="If we should remove one fps_min/max from the list of samples")
+    parser.add_argument("--show-confidence-interval", action="store_true", help="If we should show the confidence interval of the fps change")
     parser.add_argument("--show-std-deviation", action="store_true", help="If we should show the std deviation of the computed FPS average")
     parser.add_argument("--sort-by-std-deviation", action="store_true", help="If we should sort the results based on after std-deviation")
     parser.add_argument("--threshold", default=0.005, type=float, help="Threshold used to determine helped/HURT runs (default 0.005)")
@@ -126,9 +308,33 @@ def main():
     if (args.include_traces):
         include_filter = [re.compile(f, flags=re.IGNORECASE) for f in args.include_traces]
 
-    before_raw = get_results(args.before, include_filter, exclude_filter)
+    interleaved_samples = None
+    if args.interleaved is not None:
+        before_raw, after_raw, interleaved_samples = get_interleaved_results(args.interleaved, args.before, args.after,
+                                                                             include_filter, exclude_filter)
+    elif args.results_db is not None:
+        before_raw = get_store_results(args.results_db, args.before, args, include_filter, exclude_filter)
+        after_raw = get_store_results(args.results_db, args.after, args, include_filter, exclude_filter)
+    else:
+        before_raw = results_store.read_fps_file(args.before, include_filter, exclude_filter)
+        after_raw = results_store.read_fps_file(args.after, include_filter, exclude_filter)
+
+    num_abnormal = 0
+    if args.abnormal_samples is not None:
+        before_abnormal = get_abnormal_samples(args.before, before_raw, args, interleaved_samples)
+        after_abnormal = get_abnormal_samples(args.after, after_raw, args, interleaved_samples)
+        num_abnormal = sum(len(v) for v in before_abnormal.values()) + sum(len(v) for v in after_abnormal.values())
+        if num_abnormal > 0 and not args.summary_only:
+            print("")
+        if args.abnormal_samples == 'drop':
+            if args.interleaved is not None:
+                # The pairs are dropped from both commits
+                for p in set(before_abnormal) | set(after_abnormal):
+                    before_abnormal[p] = after_abnormal[p] = before_abnormal.get(p, []) + after_abnormal.get(p, [])
+            before_raw = drop_samples(before_raw, before_abnormal)
+            after_raw = drop_samples(after_raw, after_abnormal)
+
     before = process_results(before_raw, args)
-    after_raw = get_results(args.after, include_filter, exclude_filter)
     after = process_results(after_raw, args)
 
     total_before = {}
@@ -137,12 +343,12 @@ def main():
     affected_after = {}
     num_hurt = {}
     num_helped = {}
+    intervals = {}
+    affected = []
 
-    #FIXME: not measuring confidence intervals. It is not clear if
-    #that is representative here, and in case of being, we need to
-    #tweak the values for fps
-
-    # Filling up helper/hurt
+    # Filling up helper/hurt. A trace is only helped/HURT if the change
+    # is over the threshold and the confidence interval of the change
+    # excludes zero (when there are at least two samples on both runs)
     for m in measurements:
         helped = []
         hurt = []
@@ -172,13 +378,20 @@ def main():
             total_before[m] += before_count[0]
             total_after[m] += after_count[0]
 
-            kk = after_count[0] / before_count[0]
-            if (abs(kk - 1.0) >= args.threshold):
+            if args.interleaved is not None:
+                # The pairs can't be kept if min/max samples are
+                # discarded, so we use the raw samples
+                status, intervals[p] = fps_stats.classify_change(before_raw[p], after_raw[p],
+                                                                 args.threshold, args.confidence,
+                                                                 paired=True)
+            else:
+                status, intervals[p] = fps_stats.classify_change(before[p]['samples'], after[p]['samples'],
+                                                                 args.threshold, args.confidence)
+            if status is not None:
                 affected_before[m] += before_count[0]
                 affected_after[m] += after_count[0]
 
-                # Measuring only FPS, higher is always better
-                if (after_count > before_count):
+                if status == fps_stats.HELPED:
                     helped.append(p)
                 else:
                     hurt.append(p)
@@ -192,7 +405,7 @@ def main():
 
             for p in helped:
                 namestr = p
-                print(f"{m}  helped:  {get_result_string(namestr, before[p][m], after[p][m], args)}")
+                print(f"{m}  helped:  {get_result_string(namestr, before[p][m], after[p][m], args, intervals[p])}")
             if helped:
                 print("")
 
@@ -203,13 +416,14 @@ def main():
                 hurt.sort(key=lambda k: after[k][m][1])
             for p in hurt:
                 namestr = p
-                print(f"{m} HURT: {get_result_string(namestr, before[p][m], after[p][m], args)}")
+                print(f"{m} HURT: {get_result_string(namestr, before[p][m], after[p][m], args, intervals[p])}")
             if hurt:
                 print("")
 
 
         num_helped[m] = len(helped)
         num_hurt[m] = len(hurt)
+        affected += helped + hurt
 
     lost = []
     gained = []
@@ -235,6 +449,15 @@ def main():
         if gained:
             print("")
 
+    if args.counters and not args.summary_only:
+        print_counter_changes(get_counters(args.before, args), get_counters(args.after, args), affected)
+
+    if args.frame_times and not args.summary_only:
+        if args.results_db is not None:
+            print("--frame-times needs the fps files, not supported with --results-db")
+        else:
+            print_frame_time_changes(args, include_filter, exclude_filter)
+
     any_helped_or_hurt = False
     for m in measurements:
         if num_helped[m] > 0 or num_hurt[m] > 0:
@@ -242,7 +465,7 @@ def main():
 
         if num_helped[m] > 0 or num_hurt[m] > 0:
             print("total {0} in all runs: {1}\n"
-                  "total {0} in affected (through threshold) runs: {2}\n"
+                  "total {0} in affected (through threshold and confidence interval) runs: {2}\n"
                   "helped: {3}\n"
                   "HURT: {4}".format(
                       m,
@@ -255,6 +478,9 @@ def main():
             print("")
 
 
+    if num_abnormal > 0:
+        print(f"ABNORMAL samples ({'dropped' if args.abnormal_samples == 'drop' else 'kept'}): {num_abnormal}")
+
     if lost or gained:
         print(f"LOST:   {str(len(lost))}")
         print(f"GAINED: {str(len(gained))}")
@@ -0,0 +1,208 @@
+#
+# On-disk store for the fps samples measured by run-all-traces.py.
+#
+# Each sample is keyed by (mesa commit, trace, sample index, replay
+# options), so an interrupted run can be resumed, and
+# report-fps-traces.py can compare two commits without needing the
+# fps files. The host telemetry of each sample is stored as json, and
+# the perf counters of the profiled replays (--profile) on their own
+# table.
+#
+# The fps files ("trace,fps" lines) of run-all-traces.py are read here
+# too, so report-fps-traces.py and the live comparison parse them the
+# same way.
+#
+import csv
+import json
+import sqlite3
+from datetime import datetime
+
+# Status of a sample. Timeouts don't have a fps value.
+OK_STATUS = 'ok'
+TIMEOUT_STATUS = 'timeout'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    mesa_commit TEXT NOT NULL,
+    trace TEXT NOT NULL,
+    sample INTEGER NOT NULL,
+    replay_options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fps REAL,
+    timestamp TEXT NOT NULL,
+    telemetry TEXT,
+    PRIMARY KEY (mesa_commit, trace, sample, replay_options)
+)
+"""
+
+COUNTERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    mesa_commit TEXT NOT NULL,
+    trace TEXT NOT NULL,
+    replay_options TEXT NOT NULL,
+    counter TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (mesa_commit, trace, replay_options, counter)
+)
+"""
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute(SCHEMA)
+    connection.execute(COUNTERS_SCHEMA)
+    # Stores created before the telemetry was recorded
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(samples)")]
+    if 'telemetry' not in columns:
+        with connection:
+            connection.execute("ALTER TABLE samples ADD COLUMN telemetry TEXT")
+    return connection
+
+class ResultsStore:
+    """The samples of one mesa commit measured with one set of replay options"""
+
+    def __init__(self, path, mesa_commit, replay_options):
+        self.connection = connect(path)
+        self.mesa_commit = mesa_commit
+        self.replay_options = replay_options
+
+    def close(self):
+        self.connection.close()
+
+    def get_samples(self, trace):
+        """Returns a dict with the status of each stored sample index of the trace"""
+        cursor = self.connection.execute(
+            "SELECT sample, status FROM samples "
+            "WHERE mesa_commit = ? AND trace = ? AND replay_options = ?",
+            (self.mesa_commit, trace, self.replay_options))
+        return dict(cursor.fetchall())
+
+    def add_sample(self, trace, sample, status, fps=None, telemetry=None):
+        # We commit each sample, as the point of the store is to
+        # survive a run being interrupted at any moment
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.mesa_commit, trace, sample, self.replay_options, status, fps,
+                 datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(telemetry) if telemetry is not None else None))
+
+    def add_counters(self, trace, counters):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO counters VALUES (?, ?, ?, ?, ?)",
+                [(self.mesa_commit, trace, self.replay_options, counter, value)
+                 for counter, value in counters.items()])
+
+    def get_counters(self, trace):
+        cursor = self.connection.execute(
+            "SELECT counter, value FROM counters "
+            "WHERE mesa_commit = ? AND trace = ? AND replay_options = ?",
+            (self.mesa_commit, trace, self.replay_options))
+        return dict(cursor.fetchall())
+
+    def get_fps(self, trace):
+        """Returns the fps values of the stored non-timeout samples of the trace"""
+        return list(self.get_sample_fps(trace).values())
+
+    def get_sample_fps(self, trace):
+        """Returns a dict with the fps value of each stored non-timeout
+        sample index of the trace, in sample order"""
+        cursor = self.connection.execute(
+            "SELECT sample, fps FROM samples "
+            "WHERE mesa_commit = ? AND trace = ? AND replay_options = ? AND status = ? "
+            "ORDER BY sample",
+            (self.mesa_commit, trace, self.replay_options, OK_STATUS))
+        return dict(cursor.fetchall())
+
+def find_commits(path, commit):
+    """Returns the stored mesa commits starting with commit"""
+    connection = connect(path)
+    cursor = connection.execute(
+        "SELECT DISTINCT mesa_commit FROM samples WHERE substr(mesa_commit, 1, ?) = ?",
+        (len(commit), commit))
+    commits = [row[0] for row in cursor.fetchall()]
+    connection.close()
+    return commits
+
+def find_replay_options(path, mesa_commit):
+    connection = connect(path)
+    cursor = connection.execute(
+        "SELECT DISTINCT replay_options FROM samples WHERE mesa_commit = ?",
+        (mesa_commit,))
+    replay_options = [row[0] for row in cursor.fetchall()]
+    connection.close()
+    return replay_options
+
+def load_samples(path, mesa_commit, replay_options):
+    """Returns the (trace, fps) pairs of all the non-timeout samples"""
+    connection = connect(path)
+    cursor = connection.execute(
+        "SELECT trace, fps FROM samples "
+        "WHERE mesa_commit = ? AND replay_options = ? AND status = ? "
+        "ORDER BY trace, sample",
+        (mesa_commit, replay_options, OK_STATUS))
+    samples = cursor.fetchall()
+    connection.close()
+    return samples
+
+def filter_samples(rows, include_filter=None, exclude_filter=None):
+    """Returns a dict with the fps samples of each trace of the
+    (trace, fps) rows, skipping the timeouts and the traces not matching
+    the filters"""
+    raw = {}
+    for row in rows:
+        raw.setdefault(row[0], []).append(row[1])
+
+    # The filters are applied once per trace, not once per sample
+    results = {}
+    for trace, values in raw.items():
+        # We assume that if not include filter is provided, we want to process all of them
+        if include_filter and not any(r.search(trace) for r in include_filter):
+            continue
+
+        if exclude_filter and any(r.search(trace) for r in exclude_filter):
+            continue
+
+        # Replays killed by the run-all-traces.py watchdog don't
+        # have a fps value
+        values = [float(v) for v in values if v != TIMEOUT_STATUS]
+        if values:
+            results[trace] = values
+
+    return results
+
+def read_fps_file(filename, include_filter=None, exclude_filter=None):
+    """Returns a dict with the fps samples of each trace of a fps file"""
+    # Each line has the format "trace_name,fps", and can be more that one trace_name entry
+    with open(filename) as file_obj:
+        return filter_samples((row for row in csv.reader(file_obj) if len(row) >= 2),
+                              include_filter, exclude_filter)
+
+def load_telemetry(path, mesa_commit, replay_options):
+    """Returns a dict with the list of telemetries (None if not recorded)
+    of the non-timeout samples of each trace, on the order of
+    load_samples"""
+    connection = connect(path)
+    cursor = connection.execute(
+        "SELECT trace, telemetry FROM samples "
+        "WHERE mesa_commit = ? AND replay_options = ? AND status = ? "
+        "ORDER BY trace, sample",
+        (mesa_commit, replay_options, OK_STATUS))
+    telemetries = {}
+    for trace, telemetry in cursor.fetchall():
+        telemetries.setdefault(trace, []).append(json.loads(telemetry) if telemetry is not None else None)
+    connection.close()
+    return telemetries
+
+def load_counters(path, mesa_commit, replay_options):
+    """Returns a dict with the perf counters of each profiled trace"""
+    connection = connect(path)
+    cursor = connection.execute(
+        "SELECT trace, counter, value FROM counters "
+        "WHERE mesa_commit = ? AND replay_options = ?",
+        (mesa_commit, replay_options))
+    counters = {}
+    for trace, counter, value in cursor.fetchall():
+        counters.setdefault(trace, {})[counter] = value
+    connection.close()
+    return counters
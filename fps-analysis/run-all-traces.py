@@ -6,14 +6,33 @@
 # check the fps measures with a hot shader disk cache.
 #
 import argparse
+import asyncio
+import concurrent.futures
 from datetime import datetime
+import functools
+import math
 import os
 import pathlib
+import random
 import re
 import shutil
+import signal
+import statistics
 import subprocess
+import tempfile
 import time
 
+import fps_stats
+import frame_times
+import host_telemetry
+import live_compare
+import mesa_cache
+import perf_profile
+import results_store
+import shader_cache
+import trace_manifest
+import trace_staging
+
 # Sometimes we get a xcb failures on the gfxrecon replay, that we are
 # not sure how to fix or when we would be able to work on it. For now
 # we just retry a maximum amount of attempts.
@@ -22,7 +41,162 @@ import time
 
 MAX_ATTEMPTS = 3
 
-def run_trace(args, filename, fps_file, num_samples):
+# For each backend, the regex that finds the line with the fps
+# measure, and the index of the fps and frame count values between the
+# numbers of that line. Note that the stdout of the gfxrecon-replay is not always the
+# same, as for some samples there are no load time stats, so we need
+# to search for the "Measured FPS" line.
+FPS_LINE_REGEXES = {
+    '.gfxr': (re.compile(rb'Measured FPS'), 0, 2),
+    '.trace': (re.compile(rb'Rendered'), 2, 0),
+}
+NUMBER_REGEX = re.compile(rb"[-+]?\d*\.\d+|\d+")
+
+# Maximum length of a replay stdout line
+STREAM_LIMIT = 1024 * 1024
+
+# Returns the fps and the frame count (None if not found)
+async def read_fps(stream, file_extension):
+    search, fps_index, frames_index = FPS_LINE_REGEXES[file_extension]
+    async for line in stream:
+        if search.search(line) is not None:
+            numbers = NUMBER_REGEX.findall(line)
+            if len(numbers) > fps_index:
+                frames = int(float(numbers[frames_index])) if len(numbers) > frames_index else None
+                return float(numbers[fps_index]), frames
+    return 0.0, None
+
+async def drain(stream):
+    while await stream.read(65536):
+        pass
+
+async def replay(command, file_extension, env):
+    # On its own session, so a hung replay is killed with all its
+    # children (ie: when wrapped to measure its resource usage)
+    process = await asyncio.create_subprocess_exec(*command,
+                                                   env=env,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.DEVNULL,
+                                                   limit=STREAM_LIMIT,
+                                                   start_new_session=True)
+    try:
+        fps, frames = await read_fps(process.stdout, file_extension)
+        # We are not interested on the rest of the output, but we
+        # still need to consume it, or a chatty replay would block
+        # writing on the pipe.
+        await drain(process.stdout)
+        returncode = await process.wait()
+    except BaseException:
+        # Cancelled by the watchdog, or failed reading the output (ie: a
+        # line longer than STREAM_LIMIT): the replay must not keep
+        # running while the next one starts
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        raise
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+    return fps, frames
+
+# Replays the trace once, returning the fps value and the frame count
+# of the replay (None if unknown). Raises asyncio.TimeoutError (the
+# builtin TimeoutError from python 3.11 on) if the replay didn't finish
+# before the timeout (if any).
+def run_replay(command, file_extension, timeout, env=None):
+    async def watchdog():
+        return await asyncio.wait_for(replay(command, file_extension, env),
+                                      timeout if timeout > 0 else None)
+    return asyncio.run(watchdog())
+
+# Replays killed by the watchdog are written on the fps file with the
+# timeout status instead of the fps value. When several commits are
+# measured on the same fps file (--interleave), each line also has the
+# commit as tag, and the sample index, so the samples of the commits
+# measured on the same round can be paired. The host telemetry of the sample is written on its own
+# file, next to the fps file. The sample is also compared with the
+# reference of --live-reference, if any.
+def record_sample(fps_file, store, filename, sample, status, fps=None, tag=None, telemetry=None,
+                  live=None):
+    trace = os.path.basename(filename)
+    if fps_file is not None:
+        new_line = trace
+        new_line += ',' + (str(fps) if status == results_store.OK_STATUS else status)
+        if tag is not None:
+            new_line += ',' + tag + ',' + str(sample)
+        new_line += '\n'
+        fps_file.write(new_line)
+        if telemetry is not None:
+            host_telemetry.write(host_telemetry.get_file_name(fps_file.name), trace, sample, tag, telemetry)
+    if store is not None:
+        store.add_sample(trace, sample, status, fps, telemetry)
+    if live is not None and status == results_store.OK_STATUS:
+        live.add_sample(trace, fps)
+
+# With --target-ci-width we stop sampling a trace once the confidence
+# interval of its mean fps is narrow enough.
+def is_estimate_stable(args, fps_values):
+    if len(fps_values) < args.min_samples:
+        return False
+    return fps_stats.get_relative_ci_width(fps_values, args.confidence) <= args.target_ci_width
+
+@functools.cache
+def get_reference_fps(fps_file_name):
+    """Returns the mean fps of each trace of a fps file"""
+    samples = results_store.read_fps_file(fps_file_name)
+    return {trace: fps_stats.get_avg_std_deviation(values)[0] for trace, values in samples.items()}
+
+# With --profile, the traces matching --profile-traces (all by
+# default) are profiled. With --profile-reference, only those whose
+# mean fps changed more than --profile-threshold from the reference.
+def should_profile(args, filename, fps_values, store=None):
+    trace = os.path.basename(filename)
+    if args.profile_traces and not any(re.search(r, trace) for r in args.profile_traces):
+        return False
+    if store is not None and args.profile == perf_profile.STAT and store.get_counters(trace):
+        return False
+    if args.profile_reference is not None:
+        reference = get_reference_fps(os.path.expanduser(args.profile_reference)).get(trace)
+        if not reference or not fps_values:
+            return False
+        change = fps_stats.get_avg_std_deviation(fps_values)[0] / reference - 1.0
+        return abs(change) > args.profile_threshold
+    return True
+
+# The profiled replay is an extra replay, done after the measured
+# samples, so the perf overhead doesn't change the fps values.
+def run_profile(args, filename, command, file_extension, fps_file, store=None, tag=None):
+    trace = os.path.basename(filename)
+    directory = perf_profile.get_directory(fps_file.name)
+    os.makedirs(directory, exist_ok=True)
+    output_file = perf_profile.get_output_file(directory, trace, args.profile, tag)
+    if args.verbose:
+        print(f"\tprofiling with perf {args.profile} on {output_file}")
+
+    try:
+        run_replay(perf_profile.get_command(args.profile, output_file, args.profile_events) + command,
+                   file_extension, args.replay_timeout)
+    except Exception as err:
+        print(f"ERROR profiling trace {filename} : {type(err).__name__} was raised: {err}")
+        return
+
+    if args.profile == perf_profile.STAT and store is not None:
+        store.add_counters(trace, perf_profile.read_stat(output_file))
+
+# Runs the samples from first_sample to num_samples of the trace. tag
+# is written with each sample on the fps file. If profile is False the
+# trace is not profiled, even with --profile. replay_file is where the
+# trace is replayed from, if not filename (ie: a staged copy). The
+# samples, and those resumed from the results store, are also sent to
+# the live comparison, if any. Returns the fps values of the trace
+# (including the ones already on the results store), or None if it was
+# not measured.
+def run_trace(args, filename, fps_file, num_samples, store=None, adaptive=False,
+              first_sample=0, tag=None, profile=True, replay_file=None, live=None):
     if args.verbose:
         print(f"Current trace: {filename}")
 
@@ -58,54 +232,101 @@ def run_trace(args, filename, fps_file, num_samples):
         print(f"File {filename} skipped: extension {file_extension} not recognized")
         return
 
-    command += [filename]
+    if fps_file is not None and filename in args.warmup_timeouts:
+        print(f"Trace {filename} timed out on the warmup. Skipped")
+        record_sample(fps_file, store, filename, first_sample, results_store.TIMEOUT_STATUS, None, tag)
+        return
+
+    command += [replay_file or filename]
     remaining_attempts = MAX_ATTEMPTS
 
-    for sample in range(num_samples):
+    done_samples = {}
+    fps_values = []
+    if store is not None:
+        done_samples = store.get_samples(os.path.basename(filename))
+        stored_fps = store.get_sample_fps(os.path.basename(filename))
+        fps_values = list(stored_fps.values())
+        if results_store.TIMEOUT_STATUS in done_samples.values():
+            print(f"Trace {filename} timed out on a previous run. Skipped")
+            return
+        # The live comparison gets the samples of a resumed run too, or
+        # it would decide on partial data
+        if live is not None:
+            for sample, fps in stored_fps.items():
+                if first_sample <= sample < num_samples:
+                    live.add_sample(os.path.basename(filename), fps)
+
+    for sample in range(first_sample, num_samples):
+        if adaptive and is_estimate_stable(args, fps_values):
+            if args.verbose:
+                print(f"\tfps estimate stable after {len(fps_values)} samples")
+            break
+        if sample in done_samples:
+            if args.verbose:
+                print(f"\tsample {sample} already on the results store. Skipped")
+            continue
         if remaining_attempts <= 0:
             continue
         for attempt in range(remaining_attempts):
+            # On cold cache mode each measured sample compiles all its
+            # shaders again
+            if args.cold_cache and fps_file is not None:
+                shader_cache.clear(os.environ['MESA_SHADER_CACHE_DIR'])
+
+            # The frame times are captured with the mesa overlay layer,
+            # so only for the vulkan traces
+            env = None
+            overlay_file = None
+            if args.frame_times and file_extension == '.gfxr' and fps_file is not None:
+                fd, overlay_file = tempfile.mkstemp(prefix='overlay-', suffix='.txt')
+                os.close(fd)
+                env = frame_times.get_overlay_env(overlay_file)
+
+            # The warmup replays run in parallel, and are not recorded,
+            # so only the measured ones get telemetry
+            replay_command = command
+            rusage_file = None
+            if fps_file is not None:
+                fd, rusage_file = tempfile.mkstemp(prefix='rusage-', suffix='.json')
+                os.close(fd)
+                replay_command = host_telemetry.get_rusage_command(rusage_file, command)
+
             try:
-                output = subprocess.run(command,
-                                        capture_output=True,
-                                        check=True)
+                telemetry = None
+                if fps_file is not None:
+                    host_before = host_telemetry.snapshot()
+                start = time.monotonic()
+                fps, frames = run_replay(replay_command, file_extension, args.replay_timeout, env)
+                if fps_file is not None:
+                    duration = time.monotonic() - start
+                    telemetry = host_telemetry.get_telemetry(host_before, host_telemetry.snapshot(),
+                                                             host_telemetry.read_rusage(rusage_file))
+                    if args.manifest is not None:
+                        args.manifest.add_replay(filename, duration, frames)
+
+                if overlay_file is not None:
+                    frame_times.write(frame_times.get_directory(fps_file.name),
+                                      os.path.basename(filename), sample,
+                                      frame_times.read_overlay_frame_times(overlay_file), tag)
+
                 if args.verbose and args.sleep_time > 0:
                     print(f"Waiting {args.sleep_time} seconds")
                 time.sleep(args.sleep_time)
 
-                # Parse FPS value. Note that the stdout of the
-                # gfxrecon-replay is not always the same, as for some
-                # samples there are no load time stats, so we use regex to
-                # find the string with "Replay FPS" header.
-
-                split = output.stdout.splitlines()
-                fps = 0.0
-
-                # FIXME: this seems somewhat convoluted. I bet that
-                # there is way to get the FPS from the string with
-                # just one regex, without an index, and without
-                # tweaking based on gfxr vs apitrace. This works for
-                # now.
-                for line in split:
-                    if file_extension == '.gfxr':
-                        search = re.compile('Measured FPS')
-                        fps_index = 0
-                    else:
-                        search = re.compile('Rendered')
-                        fps_index = 2
-                    line_str = line.decode('utf-8')
-                    match = search.search(line_str)
-                    if match is not None:
-                        float_search = re.findall(r"[-+]?\d*\.\d+|\d+", line_str)
-                        if float_search is not None:
-                            fps = float(float_search[fps_index])
-
-                if fps_file is not None:
-                    new_line = os.path.basename(filename)
-                    new_line += ',' + str(fps)
-                    new_line += '\n'
-                    fps_file.write(new_line)
+                record_sample(fps_file, store, filename, sample, results_store.OK_STATUS, fps, tag, telemetry,
+                              live)
+                fps_values.append(fps)
 
+            except asyncio.TimeoutError:
+                # A trace that hangs once would most likely hang
+                # again, so we don't retry, and we don't try the
+                # remaining samples
+                print(f"ERROR trace {filename} timed out after {args.replay_timeout} seconds. Discarding trace")
+                # The measured pass doesn't pay the timeout again
+                if fps_file is None:
+                    args.warmup_timeouts.add(filename)
+                record_sample(fps_file, store, filename, sample, results_store.TIMEOUT_STATUS, None, tag)
+                return
             except Exception as err:
                 print(f"ERROR executing trace {filename} : {type(err).__name__} was raised: {err}")
                 if attempt < MAX_ATTEMPTS:
@@ -113,56 +334,725 @@ def run_trace(args, filename, fps_file, num_samples):
                 remaining_attempts = remaining_attempts - 1
             else:
                 break
+            finally:
+                if overlay_file is not None:
+                    os.remove(overlay_file)
+                if rusage_file is not None:
+                    os.remove(rusage_file)
         else:
             print(f"Consumed {str(MAX_ATTEMPTS)} attempts for trace {filename}. Discarding trace")
 
-# Note that although we provide a number of samples on the command
-# line arguments, we still need to pass it as a parameter, in order to
-# configure the initial cache warmup with a value of 1.
-def run_traces(args, fps_file, num_samples):
-    for directory in args.traces_directory_list:
+    if args.profile is not None and profile and fps_file is not None and \
+       should_profile(args, filename, fps_values, store):
+        run_profile(args, filename, command, file_extension, fps_file, store, tag)
+
+    return fps_values
+
+# The traces directories are searched recursively, only once. With a
+# manifest, traces with the same content on several directories are
+# only replayed once.
+@functools.cache
+def discover_traces(directories, verbose, manifest=None):
+    traces = []
+    trace_ids = {}
+    # The results are keyed by the trace basename, so the traces of
+    # different subdirectories can't share it
+    trace_names = {}
+    for directory in directories:
         full_directory = os.path.expanduser(directory)
-        if args.verbose:
+        if verbose:
             print(f"******* Current traces directory: {full_directory} *******")
-        for filename in os.listdir(full_directory):
-            f = os.path.join(full_directory, filename)
-            if os.path.isfile(f):
-                run_trace(args, f, fps_file, num_samples)
-            else:
-                if args.verbose:
-                    print(f"{f} is not a file")
+        for root, dirs, files in os.walk(full_directory):
+            dirs.sort()
+            for filename in sorted(files):
+                f = os.path.join(root, filename)
+                # Only the supported traces are hashed, so stray large
+                # files aren't read in full on every sweep
+                if manifest is not None and trace_manifest.get_backend(f) is not None:
+                    trace_id = trace_manifest.get_id(manifest.get_file(f))
+                    if trace_id in trace_ids:
+                        if verbose:
+                            print(f"{f} is the same trace as {trace_ids[trace_id]}. Skipped")
+                        continue
+                    trace_ids[trace_id] = f
+                if filename in trace_names:
+                    print(f"ERROR trace {f} has the same name as {trace_names[filename]}. Skipped")
+                    continue
+                trace_names[filename] = f
+                traces.append(f)
+    return traces
 
-def run_helper(args, results_directory):
-    if os.path.exists(results_directory) is False:
-        os.mkdir(results_directory)
+# On bisect mode only the traces of --bisect-traces are replayed
+def get_traces(args):
+    traces = discover_traces(tuple(args.traces_directory_list), args.verbose, args.manifest)
+    if args.bisect is not None:
+        return [f for f in traces if any(re.search(r, os.path.basename(f)) for r in args.bisect_traces)]
+    return list(traces)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02}m{seconds:02}s"
+
+def get_expected_duration(args, filename):
+    if args.manifest is None:
+        return None
+    duration = args.manifest.get_duration(filename)
+    return duration[0] if duration is not None else None
+
+# Estimated time to replay num_samples times each of the traces, from
+# the replay durations on the manifest. Traces never replayed are
+# estimated with the average of the others, and the traces not measured
+# take no time. Returns None if there is no manifest, or no trace was
+# ever replayed.
+def get_trace_etas(args, traces, num_samples):
+    measured = [is_trace_measured(args, f) for f in traces]
+    durations = [get_expected_duration(args, f) if m else None for f, m in zip(traces, measured)]
+    known = [d for d in durations if d is not None]
+    if not known:
+        return None
+    average = statistics.fmean(known)
+    return [((d if d is not None else average) + args.sleep_time) * num_samples if m else 0.0
+            for d, m in zip(durations, measured)]
+
+def get_eta(args, traces, num_samples):
+    etas = get_trace_etas(args, traces, num_samples)
+    return sum(etas) if etas is not None else None
 
-    if args.disable_cache_run is False:
+# The longest traces go first on the parallel warmup, so it doesn't end
+# with a long trace replayed alone. Traces never replayed go first, as
+# they may be the longest.
+def sort_longest_first(args, traces):
+    return sorted(traces, key=lambda f: -(get_expected_duration(args, f) or math.inf))
+
+# As the frame count of a trace is fixed, the noise of its replay
+# duration is the noise of its fps. With --target-ci-width the noisiest
+# traces, that need the most samples, go first.
+def sort_noisiest_first(args, traces):
+    def get_noise(f):
+        duration = args.manifest.get_duration(f)
+        if duration is None or duration[0] == 0:
+            return math.inf
+        return duration[1] / duration[0]
+    return sorted(traces, key=get_noise, reverse=True)
+
+# Note that although we provide a number of samples on the command
+# line arguments, we still need to pass it as a parameter, in order to
+# configure the initial cache warmup with a value of 1. On adaptive
+# mode num_samples is the maximum number of samples.
+def run_traces(args, fps_file, num_samples, store=None, adaptive=False, live=None):
+    traces = get_traces(args)
+    if fps_file is None:
+        for f in traces:
+            run_trace(args, f, fps_file, num_samples, store, adaptive)
+        return
+
+    if adaptive and args.manifest is not None:
+        traces = sort_noisiest_first(args, traces)
+    # The estimates are computed once, as the manifest is updated while
+    # the traces are replayed
+    etas = get_trace_etas(args, traces, num_samples)
+    if etas is not None:
+        eta = sum(etas)
+        print(f"Estimated time for {len(traces)} traces: {'at most ' if adaptive else ''}{format_duration(eta)}")
+    for i, (f, replay_file) in enumerate(get_staged_traces(args, traces)):
+        run_trace(args, f, fps_file, num_samples, store, adaptive, replay_file=replay_file, live=live)
+        if is_live_abort(args, live):
+            break
+        if etas is not None and i + 1 < len(traces):
+            eta -= etas[i]
+            print(f"{i + 1}/{len(traces)} traces done, ETA {format_duration(max(eta, 0.0))}")
+
+# The reference of --live-reference is a fps file, or a mesa commit
+# with its samples on --results-db. Returns None if it can't be read.
+def get_live_reference(args):
+    reference = os.path.expanduser(args.live_reference)
+    if os.path.isfile(reference):
+        return results_store.read_fps_file(reference)
+
+    if args.results_db is None:
+        print(f"--live-reference {args.live_reference} is not a file, and there is no --results-db to find it as a mesa commit")
+        return None
+    results_db = os.path.expanduser(args.results_db)
+    commits = results_store.find_commits(results_db, args.live_reference)
+    if len(commits) != 1:
+        print(f"--live-reference {args.live_reference} matches {len(commits)} commits on {args.results_db}")
+        return None
+    return results_store.filter_samples(results_store.load_samples(results_db, commits[0], get_replay_options(args)))
+
+def get_live_comparison(args, name):
+    if args.live_samples is None:
+        return None
+    return live_compare.LiveComparison(name, args.live_samples, args.threshold, args.confidence,
+                                       args.live_warnings)
+
+# With --abort-hurt, a run stops once that many traces are HURT
+# compared with the live reference.
+def is_live_abort(args, live):
+    if live is None or args.abort_hurt is None:
+        return False
+    hurt = live.get_traces(fps_stats.HURT)
+    if len(hurt) < args.abort_hurt:
+        return False
+    print(f"Aborting the run of {live.name}: {len(hurt)} traces HURT ({', '.join(hurt)})")
+    return True
+
+# With --stage-dir or --prefetch-traces, the measured traces are
+# staged (copied to the stage directory, or read on the page cache)
+# ahead of their replays. Traces keep their name, so the staged copies
+# are stored with the same name on the results.
+def get_staged_traces(args, traces):
+    if args.stage_dir is None and not args.prefetch_traces:
+        return [(f, f) for f in traces]
+    stage_directory = None
+    if args.stage_dir is not None:
+        stage_directory = os.path.expanduser(args.stage_dir)
+        os.makedirs(stage_directory, exist_ok=True)
+    return trace_staging.staged(traces, stage_directory, int(args.stage_budget * 1024**3),
+                                lambda f: is_trace_measured(args, f))
+
+def is_trace_measured(args, filename):
+    file_extension = pathlib.Path(filename).suffix
+    if file_extension == '.gfxr':
+        return not args.skip_gfxrecon
+    if file_extension == '.trace':
+        return not args.skip_apitrace
+    return False
+
+def get_num_samples(args):
+    if args.target_ci_width is not None:
+        return args.max_samples
+    return args.num_samples
+
+# If all the samples were already measured by a previous run, so we
+# can skip the whole run, including the mesa rebuild. Traces that
+# timed out are complete, as we don't try their remaining samples.
+def is_run_complete(args, store):
+    if store is None:
+        return False
+    for f in get_traces(args):
+        if not is_trace_measured(args, f):
+            continue
+        trace = os.path.basename(f)
+        samples = store.get_samples(trace)
+        if results_store.TIMEOUT_STATUS in samples.values():
+            continue
+        if args.target_ci_width is not None and is_estimate_stable(args, store.get_fps(trace)):
+            continue
+        if sum(1 for s in samples if s < get_num_samples(args)) < get_num_samples(args):
+            return False
+    return True
+
+# The replay options that can change the fps measures, used as part
+# of the results store key.
+def get_replay_options(args):
+    options = []
+    if args.headless:
+        options.append('headless')
+    if args.rebind:
+        options.append('rebind')
+    if args.remove_unsupported:
+        options.append('remove-unsupported')
+    if args.cold_cache:
+        options.append('cold-cache')
+    # The overlay layer capturing the frame times has its own overhead
+    if args.frame_times:
+        options.append('frame-times')
+    return ','.join(options)
+
+def get_mesa_commit(mesa_directory, commit):
+    output = subprocess.run(['git', 'rev-parse', '--verify', commit + '^{commit}'],
+                            cwd=mesa_directory, capture_output=True, check=True)
+    return output.stdout.decode('utf-8').strip()
+
+def open_results_store(args, mesa_directory, commit):
+    if args.results_db is None:
+        return None
+    try:
+        mesa_commit = get_mesa_commit(mesa_directory, commit)
+    except Exception as err:
+        print(f"ERROR getting the hash of mesa commit {commit} : {type(err).__name__} was raised: {err}")
+        return None
+    return results_store.ResultsStore(os.path.expanduser(args.results_db), mesa_commit,
+                                      get_replay_options(args))
+
+# The warmup pass only cares about filling the on-disk shader cache,
+# so unlike the measured pass it is fine to run several replays at
+# the same time.
+def run_warmup(args):
+    start = time.monotonic()
+    if args.warmup_jobs > 1:
+        # The durations of the parallel replays are inflated by the
+        # contention between them, so the time saved is estimated with
+        # the serial durations on the manifest, if all are known
+        traces = sort_longest_first(args, get_traces(args))
+        serial = [get_expected_duration(args, f) for f in traces if is_trace_measured(args, f)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.warmup_jobs) as executor:
+            list(executor.map(lambda f: run_trace(args, f, None, 1), traces))
+        elapsed = time.monotonic() - start
+        saved = ""
+        if serial and None not in serial:
+            saved = f" ({max(sum(serial) - elapsed, 0.0):.2f} seconds saved)"
+        print(f"Warmup took {elapsed:.2f} seconds using {args.warmup_jobs} jobs{saved}")
+    else:
+        run_traces(args, None, 1)
+        elapsed = time.monotonic() - start
+        print(f"Warmup took {elapsed:.2f} seconds")
+
+# Returns the shader cache directory the replays of the mesa commit
+# should use, already warmed up, or None to use the default one. With
+# --shader-cache-dir the warmup is only done the first time, and saved
+# as a snapshot that later runs restore. On cold cache mode it is just
+# an empty directory.
+def prepare_shader_cache(args, commit):
+    # The traces that time out on the warmup of this commit
+    args.warmup_timeouts = set()
+    if args.cold_cache:
+        return tempfile.mkdtemp(prefix='mesa-shader-cache-')
+
+    mesa_commit = None
+    if args.shader_cache_dir is not None:
+        try:
+            mesa_commit = get_mesa_commit(os.path.expanduser(args.mesa_directory), commit)
+        except Exception as err:
+            print(f"ERROR getting the hash of mesa commit {commit} : {type(err).__name__} was raised: {err}")
+
+    if mesa_commit is None:
+        if args.disable_cache_run is False:
+            if args.verbose:
+                print("Warming up shader cache")
+            run_warmup(args)
+        return None
+
+    snapshot_directory = os.path.expanduser(args.shader_cache_dir)
+    os.makedirs(snapshot_directory, exist_ok=True)
+    # The build options only apply to the mesa installs built by us
+    build_options = args.mesa_build_options if args.mesa_install_cache is not None else ''
+    key = shader_cache.get_key(mesa_commit, [f for f in get_traces(args) if is_trace_measured(args, f)],
+                               build_options)
+
+    # Created next to the snapshots, so copying them is fast
+    directory = tempfile.mkdtemp(prefix='work-', dir=snapshot_directory)
+    if shader_cache.restore(snapshot_directory, key, directory):
+        print(f"Restored shader cache snapshot {key} of commit {commit}. Warmup skipped")
+    elif args.disable_cache_run is False:
         if args.verbose:
             print("Warming up shader cache")
-        run_traces(args, None, 1)
+        with shader_cache.cache_env(directory):
+            run_warmup(args)
+        shader_cache.save(snapshot_directory, key, directory)
+        print(f"Saved shader cache snapshot {key} of commit {commit}")
+    return directory
+
+# Returns the prefix of the cached mesa install of the commit, building
+# it if needed, or None if something failed. The prefixes on keep are
+# not evicted from the cache.
+def get_cached_mesa(args, mesa_directory, commit, keep=(), env=None, build_cpus=None):
+    cache_directory = os.path.expanduser(args.mesa_install_cache)
+    try:
+        mesa_commit = get_mesa_commit(mesa_directory, commit)
+    except Exception as err:
+        print(f"ERROR getting the hash of mesa commit {commit} : {type(err).__name__} was raised: {err}")
+        return None
+
+    prefix = mesa_cache.lookup(cache_directory, mesa_commit, args.mesa_build_options)
+    if prefix is not None:
+        print(f"Using cached mesa install for commit {commit} at {prefix}")
+    else:
+        print(f"Building mesa at commit {commit}")
+        start = time.monotonic()
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            prefix = mesa_cache.build(cache_directory, mesa_directory, mesa_commit,
+                                      args.mesa_build_options, args.verbose, env, build_cpus)
+        except Exception as err:
+            print(f"ERROR building mesa at commit {commit} : {type(err).__name__} was raised: {err}")
+            return None
+        print(f"Mesa at commit {commit} built in {time.monotonic() - start:.2f} seconds")
+
+    mesa_cache.evict(cache_directory, int(args.mesa_install_cache_size * 1024**3),
+                     keep=(prefix,) + tuple(keep))
+    return prefix
+
+def parse_cpu_list(cpu_list):
+    """Parses a cpu list like "0-7,16" """
+    cpus = set()
+    for cpu_range in cpu_list.split(','):
+        first, _, last = cpu_range.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def timed(function, *function_args):
+    start = time.monotonic()
+    result = function(*function_args)
+    return result, time.monotonic() - start
+
+# Measures the commits using the mesa install cache. With
+# --build-ahead, the next commit is built while the current one is
+# being measured.
+def run_cached_commits(args, mesa_directory, commits, base_results_directory):
+    build_cpus = None
+    if args.build_cpus is not None:
+        build_cpus = parse_cpu_list(args.build_cpus)
+        replay_cpus = os.sched_getaffinity(0) - build_cpus
+        if not replay_cpus:
+            print("No cpus left for the replays after --build-cpus")
+            return
+        # The replays inherit the affinity of this process
+        os.sched_setaffinity(0, replay_cpus)
+        print(f"Building on cpus {mesa_cache.format_cpu_list(build_cpus)}, replaying on cpus {mesa_cache.format_cpu_list(replay_cpus)}")
+
+    # The builds don't use the environment of the mesa install being
+    # measured
+    build_env = dict(os.environ)
+
+    sweep_start = time.monotonic()
+    total_build = 0.0
+    total_wait = 0.0
+    total_measure = 0.0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as builder:
+        future = builder.submit(timed, get_cached_mesa, args, mesa_directory, commits[0][1],
+                                (), build_env, build_cpus)
+        for i, (index, commit, store) in enumerate(commits):
+            start = time.monotonic()
+            prefix, build_time = future.result()
+            wait_time = time.monotonic() - start
+            if prefix is None:
+                return
+            total_build += build_time
+            total_wait += wait_time
+
+            has_next = i + 1 < len(commits)
+            if has_next and args.build_ahead:
+                future = builder.submit(timed, get_cached_mesa, args, mesa_directory, commits[i + 1][1],
+                                        (prefix,), build_env, build_cpus)
+
+            results_directory = base_results_directory + "-" + str(index) + "-" + commit
+            start = time.monotonic()
+            with mesa_cache.loader_env(prefix):
+                run_helper(args, results_directory, store, commit)
+            measure_time = time.monotonic() - start
+            total_measure += measure_time
+
+            print(f"Commit {commit}: mesa ready in {build_time:.2f} seconds (waited {wait_time:.2f}), measured in {measure_time:.2f} seconds")
+
+            if has_next and not args.build_ahead:
+                future = builder.submit(timed, get_cached_mesa, args, mesa_directory, commits[i + 1][1],
+                                        (), build_env, build_cpus)
+
+    sweep_time = time.monotonic() - sweep_start
+    print(f"Sweep took {sweep_time:.2f} seconds: build {total_build:.2f}, measure {total_measure:.2f}, "
+          f"build/measure overlap {max(total_build - total_wait, 0.0):.2f} seconds")
+
+# Measures all the commits at the same time, from their installs on the
+# mesa cache: for each trace and sample, each commit is replayed once,
+# on the same order (abab) or on a random order for each sample
+# (random). This way any thermal or background drift affects all the
+# commits the same. All the samples go to the same fps file, tagged
+# with their commit.
+def run_interleaved_commits(args, mesa_directory, commits, base_results_directory):
+    prefixes = []
+    tags = []
+    for index, commit, store in commits:
+        prefix = get_cached_mesa(args, mesa_directory, commit, keep=tuple(prefixes))
+        if prefix is None:
+            return
+        prefixes.append(prefix)
+        tags.append(get_mesa_commit(mesa_directory, commit))
+
+    shader_cache_directories = []
+    warmup_timeouts = []
+    for (index, commit, store), prefix in zip(commits, prefixes):
+        if args.verbose:
+            print(f"Preparing shader cache for commit {commit}")
+        with mesa_cache.loader_env(prefix):
+            shader_cache_directories.append(prepare_shader_cache(args, commit))
+        warmup_timeouts.append(args.warmup_timeouts)
+
+    try:
+        run_interleaved_samples(args, commits, prefixes, tags, shader_cache_directories,
+                                warmup_timeouts, base_results_directory)
+    finally:
+        for directory in shader_cache_directories:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+
+def run_interleaved_samples(args, commits, prefixes, tags, shader_cache_directories,
+                            warmup_timeouts, base_results_directory):
+    results_directory = base_results_directory + "-interleaved"
+    if os.path.exists(results_directory) is False:
+        os.mkdir(results_directory)
     fps_file_name = results_directory + '/fps-stats-' + datetime.now().strftime("%Y-%m-%d_%H:%M:%S")+'.txt'
+    lives = [get_live_comparison(args, commit) for index, commit, store in commits]
+    aborted = set()
     with open(fps_file_name, 'w') as fps_file:
         if args.verbose:
-            print(f"Starting FPS run. Writing stats on file {fps_file_name}")
-        run_traces(args, fps_file, args.num_samples)
+            print(f"Starting interleaved FPS run. Writing stats on file {fps_file_name}")
+        for f, replay_file in get_staged_traces(args, get_traces(args)):
+            # The commits where the trace timed out (or was skipped) are
+            # not replayed again on the next samples
+            discarded = set()
+            for sample in range(args.num_samples):
+                order = [i for i in range(len(commits)) if i not in aborted and i not in discarded]
+                if args.interleave == 'random':
+                    random.shuffle(order)
+                for i in order:
+                    args.warmup_timeouts = warmup_timeouts[i]
+                    with mesa_cache.loader_env(prefixes[i]), \
+                         shader_cache.cache_env(shader_cache_directories[i]):
+                        fps_values = run_trace(args, f, fps_file, sample + 1, commits[i][2],
+                                               first_sample=sample, tag=tags[i],
+                                               profile=sample == args.num_samples - 1,
+                                               replay_file=replay_file, live=lives[i])
+                    if fps_values is None:
+                        discarded.add(i)
+            aborted.update(i for i in range(len(commits)) if i not in aborted and is_live_abort(args, lives[i]))
+            if len(aborted) == len(commits):
+                break
+
+    for live in lives:
+        if live is not None:
+            live.print_summary()
+
+# The commits to bisect: good, and the first parent chain from good to
+# bad.
+def get_bisect_commits(mesa_directory, good, bad):
+    output = subprocess.run(['git', 'rev-list', '--first-parent', '--reverse', f"{good}..{bad}"],
+                            cwd=mesa_directory, capture_output=True, check=True)
+    return [get_mesa_commit(mesa_directory, good)] + output.stdout.decode('utf-8').split()
+
+def get_commit_subject(mesa_directory, commit):
+    output = subprocess.run(['git', 'log', '-1', '--format=%h %s', commit],
+                            cwd=mesa_directory, capture_output=True, check=True)
+    return output.stdout.decode('utf-8').strip()
+
+# Measures the traces (names) on the commit until they have num_samples
+# samples, reusing the samples already measured (on this bisect, or on
+# the results store) and the mesa install cache. The samples of each
+# trace are kept on samples[commit]. Returns False if something failed.
+def measure_bisect_commit(args, mesa_directory, base_results_directory, commit, traces, num_samples,
+                          samples):
+    commit_samples = samples.setdefault(commit, {})
+    store = open_results_store(args, mesa_directory, commit)
+    if store is not None:
+        for trace in traces:
+            commit_samples.setdefault(trace, store.get_fps(trace))
+
+    traces = [f for f in get_traces(args) if os.path.basename(f) in traces and
+              len(commit_samples.get(os.path.basename(f), [])) < num_samples]
+    if not traces:
+        return True
+
+    prefix = get_cached_mesa(args, mesa_directory, commit)
+    if prefix is None:
+        return False
+
+    results_directory = base_results_directory + "-bisect-" + commit[:12]
+    if os.path.exists(results_directory) is False:
+        os.mkdir(results_directory)
+    fps_file_name = results_directory + '/fps-stats-' + datetime.now().strftime("%Y-%m-%d_%H:%M:%S")+'.txt'
+    with mesa_cache.loader_env(prefix):
+        shader_cache_directory = prepare_shader_cache(args, commit)
+        try:
+            with open(fps_file_name, 'a') as fps_file, shader_cache.cache_env(shader_cache_directory):
+                for f in traces:
+                    trace = os.path.basename(f)
+                    values = commit_samples.get(trace, [])
+                    # Without a store run_trace only returns the new values
+                    new_values = run_trace(args, f, fps_file, num_samples, store,
+                                           first_sample=0 if store is not None else len(values))
+                    if store is None:
+                        new_values = values + (new_values or [])
+                    commit_samples[trace] = new_values or []
+        finally:
+            if shader_cache_directory is not None:
+                shutil.rmtree(shader_cache_directory, ignore_errors=True)
+    return True
+
+# Classifies the commit as good or bad for the trace, with the same
+# helped/HURT test as report-fps-traces.py: bad if it is HURT compared
+# with good, but not compared with bad, and the other way around. Returns
+# None if it is ambiguous.
+def classify_bisect_commit(args, good, commit, bad):
+    from_good, _ = fps_stats.classify_change(good, commit, args.threshold, args.confidence)
+    to_bad, _ = fps_stats.classify_change(commit, bad, args.threshold, args.confidence)
+    if from_good == fps_stats.HURT and to_bad is None:
+        return 'bad'
+    if from_good is None and to_bad == fps_stats.HURT:
+        return 'good'
+    return None
+
+# Binary search of the first bad commit between --bisect GOOD BAD, for
+# the traces of --bisect-traces. Each commit gets the --min-samples
+# samples (or --num-samples if more) first, and only when it is
+# ambiguous more samples are added, up to --max-samples.
+def run_bisect(args, mesa_directory, base_results_directory):
+    good, bad = args.bisect
+    try:
+        commits = get_bisect_commits(mesa_directory, good, bad)
+    except Exception as err:
+        print(f"ERROR getting the commits between {good} and {bad} : {type(err).__name__} was raised: {err}")
+        return
+    traces = [os.path.basename(f) for f in get_traces(args) if is_trace_measured(args, f)]
+    if not traces:
+        print("No traces match --bisect-traces")
+        return
+    print(f"Bisecting {len(commits) - 1} commits for traces {', '.join(traces)}")
+
+    samples = {}
+    step = max(args.min_samples, args.num_samples)
+
+    def measure(commit, num_samples):
+        return measure_bisect_commit(args, mesa_directory, base_results_directory, commit,
+                                     traces, num_samples, samples)
+
+    # Only the traces that really regressed between good and bad are
+    # bisected
+    num_samples = step
+    while True:
+        if not measure(commits[0], num_samples) or not measure(commits[-1], num_samples):
+            return
+        regressed = [t for t in traces if samples[commits[0]].get(t) and samples[commits[-1]].get(t) and
+                     fps_stats.classify_change(samples[commits[0]][t], samples[commits[-1]][t],
+                                               args.threshold, args.confidence)[0] == fps_stats.HURT]
+        if len(regressed) == len(traces) or num_samples >= args.max_samples:
+            break
+        num_samples = min(num_samples + step, args.max_samples)
+    for t in traces:
+        if t not in regressed:
+            print(f"Trace {t} is not HURT between {good} and {bad}. Not bisected")
+    if not regressed:
+        return
+    traces = regressed
+
+    # As with "git bisect skip", the commits where a trace has no valid
+    # samples (ie: all its replays failed) are neither good nor bad, and
+    # the commits next to them are measured instead
+    low = 0
+    high = len(commits) - 1
+    skipped = set()
+    while True:
+        candidates = [i for i in range(low + 1, high) if i not in skipped]
+        if not candidates:
+            break
+        middle = min(candidates, key=lambda i: abs(i - (low + high) // 2))
+        commit = commits[middle]
+        num_samples = step
+        while True:
+            if not measure(commit, num_samples):
+                return
+            missing = [t for t in traces if not samples[commit].get(t)]
+            if missing:
+                verdict = None
+                break
+            verdicts = [classify_bisect_commit(args, samples[commits[low]][t], samples[commit][t],
+                                               samples[commits[high]][t]) for t in traces]
+            if None not in verdicts and len(set(verdicts)) == 1:
+                verdict = verdicts[0]
+                break
+            if num_samples >= args.max_samples:
+                # Still ambiguous: each trace votes for the side its mean
+                # fps is closer to
+                votes = []
+                for t in traces:
+                    avg = fps_stats.get_avg_std_deviation(samples[commit][t])[0]
+                    good_avg = fps_stats.get_avg_std_deviation(samples[commits[low]][t])[0]
+                    bad_avg = fps_stats.get_avg_std_deviation(samples[commits[high]][t])[0]
+                    votes.append('good' if abs(avg - good_avg) < abs(avg - bad_avg) else 'bad')
+                verdict = 'bad' if votes.count('bad') > votes.count('good') else 'good'
+                print(f"WARNING commit {commit} is still ambiguous after {num_samples} samples, taken as {verdict}")
+                break
+            num_samples = min(num_samples + step, args.max_samples)
+            print(f"Commit {commit} is ambiguous, measuring up to {num_samples} samples")
+
+        if verdict is None:
+            print(f"WARNING commit {get_commit_subject(mesa_directory, commit)} has no valid samples of "
+                  f"{', '.join(missing)}. Skipped")
+            skipped.add(middle)
+            continue
+        print(f"Commit {get_commit_subject(mesa_directory, commit)} is {verdict} ({num_samples} samples)")
+        if verdict == 'bad':
+            high = middle
+        else:
+            low = middle
+
+    num_replays = sum(len(values) for commit_samples in samples.values() for values in commit_samples.values())
+    if high - low > 1:
+        print(f"Only skipped commits are left. The first bad commit for {', '.join(traces)} is one of:")
+        for commit in commits[low + 1:high + 1]:
+            print(f"\t{get_commit_subject(mesa_directory, commit)}")
+    else:
+        print(f"First bad commit for {', '.join(traces)}: {get_commit_subject(mesa_directory, commits[high])}")
+    print(f"Used {len(samples)} commits and {num_replays} samples (including the ones already on the results store)")
+
+def run_helper(args, results_directory, store=None, commit='HEAD'):
+    if os.path.exists(results_directory) is False:
+        os.mkdir(results_directory)
+
+    shader_cache_directory = prepare_shader_cache(args, commit)
+    fps_file_name = results_directory + '/fps-stats-' + datetime.now().strftime("%Y-%m-%d_%H:%M:%S")+'.txt'
+    live = get_live_comparison(args, commit)
+    try:
+        with open(fps_file_name, 'w') as fps_file, shader_cache.cache_env(shader_cache_directory):
+            if args.verbose:
+                print(f"Starting FPS run. Writing stats on file {fps_file_name}")
+            run_traces(args, fps_file, get_num_samples(args), store,
+                       args.target_ci_width is not None, live)
+    finally:
+        if shader_cache_directory is not None:
+            shutil.rmtree(shader_cache_directory, ignore_errors=True)
+    if live is not None:
+        live.print_summary()
 
 def main():
     parser = argparse.ArgumentParser()
 
     # Keep command line options sorted alphabetically
+    parser.add_argument("--abort-hurt", nargs='?', type=int, help="With --live-reference, stop measuring a mesa commit once this number of traces are HURT")
+    parser.add_argument("--bisect", nargs=2, metavar=("GOOD", "BAD"), help="Find the first mesa commit between GOOD and BAD where the --bisect-traces regressed, with a binary search measuring only those traces. Needs --mesa-directory and --mesa-install-cache")
+    parser.add_argument("--bisect-traces", default=[], action="append", metavar="<regex>", help="With --bisect, the regressed traces (can be used more than once)")
+    parser.add_argument("--build-ahead", action="store_true", help="With --mesa-install-cache, build the next mesa commit while the current one is being measured")
+    parser.add_argument("--build-cpus", nargs='?', type=str, help="With --mesa-install-cache, cpus used to build mesa (ie: 0-7). The replays run on the remaining cpus")
+    parser.add_argument("--cold-cache", action="store_true", help="Clear the shader cache before each sample, so the fps include the shader compile stalls (use --frame-times to see them as stutters). The samples are stored apart from the hot cache ones on --results-db. Implies --disable-cache-run")
+    parser.add_argument("--confidence", nargs='?', default=0.95, type=float, help="Confidence level of the interval used by --target-ci-width and --live-reference (default 0.95)")
     parser.add_argument("--disable-cache-run", action="store_true",
                         help="By default we do a first run to ensure a hot shader cache, not included for the fps stats")
+    parser.add_argument("--frame-times", action="store_true", help="Capture the per-frame times of the gfxrecon traces with the VK_LAYER_MESA_overlay layer, stored on a frame-times-<date> directory next to the fps file. Ignored for apitrace")
     parser.add_argument("--headless", action="store_true", help="If we run both apitrace/gfxrecon-replay headless")
-    parser.add_argument("--num-samples", nargs='?', default=1, type=int, help="Number of times each trace is executed to get the (averaged) fps value. Not include the shaderdb run")
+    parser.add_argument("--interleave", choices=['abab', 'random'], help="With --mesa-install-cache, replay the commits interleaved for each trace sample, on the same (abab) or a random order, writing all the samples tagged with their commit on a results-interleaved fps file")
+    parser.add_argument("--live-reference", nargs='?', type=str, help="Compare each sample, as it is measured, with this reference: a fps file, or a mesa commit on --results-db. The traces that get helped/HURT are printed right away")
+    parser.add_argument("--live-warnings", nargs='?', type=str, help="With --live-reference, also append the helped/HURT traces to this file")
+    parser.add_argument("--max-samples", nargs='?', default=20, type=int, help="Maximum number of samples per trace with --target-ci-width (default 20)")
+    parser.add_argument("--mesa-build-options", nargs='?', default="", type=str, help="meson options used to build mesa with --mesa-install-cache (ie: \"-Dvulkan-drivers=intel -Dbuildtype=release\")")
     parser.add_argument("--mesa-commit-list", nargs='+', action="extend", type=str, help="List of mesa commits to execute the script against")
     parser.add_argument("--mesa-directory", nargs='?', type=str, help="Mesa directory. Useful if we pass a list of mesa commits")
+    parser.add_argument("--mesa-install-cache", nargs='?', type=str, help="Directory where each commit of --mesa-commit-list is built and installed with meson (instead of jhbuild), keyed by commit and build options, so later runs reuse it")
+    parser.add_argument("--mesa-install-cache-size", nargs='?', default=20, type=float, help="Maximum size in GB of --mesa-install-cache. Least recently used installs are removed (default 20)")
+    parser.add_argument("--min-samples", nargs='?', default=3, type=int, help="Minimum number of samples per trace with --target-ci-width (default 3)")
+    parser.add_argument("--num-samples", nargs='?', default=1, type=int, help="Number of times each trace is executed to get the (averaged) fps value. Not include the shaderdb run")
+    parser.add_argument("--prefetch-traces", action="store_true", help="Read the next traces on the page cache while the current one is replayed, so the first sample doesn't pay for reading them. Ignored with --stage-dir")
+    parser.add_argument("--profile", choices=[perf_profile.STAT, perf_profile.RECORD], help="After measuring each trace, replay it once more under perf stat (counters) or perf record (sampling profile), stored on a profile-<date> directory next to the fps file. The counters are also stored on --results-db")
+    parser.add_argument("--profile-events", nargs='?', type=str, help="With --profile stat, the events to count (perf stat -e), instead of the perf default ones")
+    parser.add_argument("--profile-reference", nargs='?', type=str, help="With --profile, only profile the traces whose mean fps changed more than --profile-threshold from this fps file")
+    parser.add_argument("--profile-threshold", nargs='?', default=0.05, type=float, help="With --profile-reference, fps change needed to profile a trace (default 0.05)")
+    parser.add_argument("--profile-traces", default=[], action="append", metavar="<regex>", help="With --profile, only profile the matching traces (can be used more than once)")
     parser.add_argument("--remove-unsupported", action="store_true", help="If we call gfxrecon-replay with --remove-unsupported. Ignored for apitrace")
     parser.add_argument("--rebind", action="store_true", help="If we call gfxrecon-replay with -m rebind. Ignored for apitrace")
+    parser.add_argument("--replay-timeout", nargs='?', default=600, type=int, help="Seconds after which a hung replay is killed and recorded as timeout on the fps file. 0 disables it")
+    parser.add_argument("--results-db", nargs='?', type=str, help="SQLite results store. Samples already stored for the same mesa commit and replay options are skipped, so an interrupted run can be resumed. Needs --mesa-directory")
+    parser.add_argument("--shader-cache-dir", nargs='?', type=str, help="Directory to keep snapshots of the warmed up shader cache of each mesa commit and set of traces, so later runs restore them instead of doing the warmup pass. Needs --mesa-directory")
     parser.add_argument("--skip-apitrace", action="store_true", help="If we should skip running the apitrace traces")
     parser.add_argument("--skip-gfxrecon", action="store_true", help="If we should skip running the gfxreconstruct traces")
     parser.add_argument("--sleep-time", nargs='?', default=0, type=int, help="Sleep time between trace execution (not applied on cache warmup")
+    parser.add_argument("--stage-budget", nargs='?', default=4.0, type=float, help="Maximum size of the traces staged ahead, in GB, with --stage-dir or --prefetch-traces (default 4)")
+    parser.add_argument("--stage-dir", nargs='?', type=str, help="Fast local directory (ie: a tmpfs) where the next traces are copied while the current one is replayed, and replayed from")
+    parser.add_argument("--target-ci-width", nargs='?', type=float, help="Keep sampling each trace until the confidence interval of its mean fps is narrower than this fraction of the mean (ie: 0.02), within --min-samples/--max-samples. Replaces --num-samples")
+    parser.add_argument("--threshold", nargs='?', default=0.005, type=float, help="With --live-reference, threshold used to determine helped/HURT traces, like report-fps-traces.py (default 0.005)")
+    parser.add_argument("--trace-manifest", nargs='?', type=str, help="Json file caching the metadata of the traces (content hash, frame count, replay durations), used to replay the same trace found on several directories once, to sort the traces (longest first on the parallel warmup, noisiest first with --target-ci-width) and to estimate the time left")
     parser.add_argument("--traces-directory-list", nargs='+', default=["traces"], type=str, help="List of directories with the traces")
     parser.add_argument("--verbose", action="store_true", default=False, help="Enable to print additional debug messages")
+    parser.add_argument("--warmup-jobs", nargs='?', default=1, type=int, help="Number of traces replayed in parallel during the shader cache warmup. The fps run is always serial")
 
     args = parser.parse_args()
 
@@ -170,24 +1060,129 @@ def main():
         print("List of mesa commits too big (maximum value is 10)")
         return
 
+    if args.warmup_jobs < 1:
+        print("--warmup-jobs needs to be at least 1")
+        return
+
+    if args.target_ci_width is not None and not 2 <= args.min_samples <= args.max_samples:
+        print("--min-samples needs to be at least 2, and not bigger than --max-samples")
+        return
+
+    if args.results_db is not None and args.mesa_directory is None:
+        print("--results-db needs --mesa-directory to know the mesa commit being measured")
+        return
+
+    if args.shader_cache_dir is not None and args.mesa_directory is None:
+        print("--shader-cache-dir needs --mesa-directory to know the mesa commit of the snapshots")
+        return
+
     if args.skip_gfxrecon and args.skip_apitrace:
         print("Both --skip-gfxrecon and --skip-apitrace options used. Nothing to do")
         return
 
-    # We ensure that the on-disk-cache is enabled, as we want hot-cache fps numbers
-    os.unsetenv("MESA_GLSL_CACHE_DISABLE")
-    os.unsetenv("MESA_SHADER_CACHE_DISABLE")
+    if args.mesa_install_cache is not None and args.mesa_commit_list is None and args.bisect is None:
+        print("--mesa-install-cache needs --mesa-commit-list or --bisect")
+        return
+
+    if args.interleave is not None:
+        if args.mesa_install_cache is None or len(args.mesa_commit_list) < 2:
+            print("--interleave needs --mesa-install-cache and at least two commits on --mesa-commit-list")
+            return
+        if args.target_ci_width is not None or args.build_ahead:
+            print("--interleave can't be used with --target-ci-width or --build-ahead")
+            return
+
+    if args.profile is not None and shutil.which('perf') is None:
+        print("--profile needs perf")
+        return
+
+    if (args.build_ahead or args.build_cpus is not None) and args.mesa_install_cache is None:
+        print("--build-ahead and --build-cpus need --mesa-install-cache")
+        return
+
+    if args.bisect is not None:
+        if args.mesa_directory is None or args.mesa_install_cache is None or not args.bisect_traces:
+            print("--bisect needs --mesa-directory, --mesa-install-cache and --bisect-traces")
+            return
+        if args.mesa_commit_list is not None or args.interleave is not None:
+            print("--bisect can't be used with --mesa-commit-list or --interleave")
+            return
+
+    if args.abort_hurt is not None and args.live_reference is None:
+        print("--abort-hurt needs --live-reference")
+        return
+
+    args.live_samples = None
+    if args.live_reference is not None:
+        args.live_samples = get_live_reference(args)
+        if args.live_samples is None:
+            return
+
+    args.manifest = None
+    args.warmup_timeouts = set()
+    if args.trace_manifest is not None:
+        args.manifest = trace_manifest.Manifest(os.path.expanduser(args.trace_manifest))
+
+    # We ensure that the on-disk-cache is enabled, as we want hot-cache
+    # fps numbers. Note that os.unsetenv would not update os.environ,
+    # that we use to build the environment of some replays.
+    os.environ.pop("MESA_GLSL_CACHE_DISABLE", None)
+    os.environ.pop("MESA_SHADER_CACHE_DISABLE", None)
 
     # FIXME: hardcoded. Perhaps a new command line argument (but we already have a lot)
     base_results_directory = "results"
 
-    if (args.mesa_commit_list is None):
-        run_helper(args, base_results_directory)
+    if args.bisect is not None:
+        run_bisect(args, os.path.expanduser(args.mesa_directory), base_results_directory)
+    elif (args.mesa_commit_list is None):
+        store = None
+        if args.results_db is not None:
+            store = open_results_store(args, os.path.expanduser(args.mesa_directory), 'HEAD')
+            if store is None:
+                return
+        if is_run_complete(args, store):
+            print(f"All the samples are already on {args.results_db}. Nothing to do")
+            return
+        run_helper(args, base_results_directory, store)
     else:
+        mesa_directory = os.path.expanduser(args.mesa_directory)
+
+        # Commits with all their samples already on the results store
+        # are skipped
+        commits = []
         index = 0
         for commit in args.mesa_commit_list:
+            store = None
+            if args.results_db is not None:
+                store = open_results_store(args, mesa_directory, commit)
+                if store is None:
+                    return
+            if is_run_complete(args, store):
+                print(f"All the samples of commit {commit} are already on {args.results_db}. Skipped")
+            else:
+                commits.append((index, commit, store))
+            index = index + 1
+
+        if not commits:
+            return
+
+        eta = get_eta(args, get_traces(args), get_num_samples(args))
+        if eta is not None:
+            if args.disable_cache_run is False and not args.cold_cache:
+                eta += get_eta(args, get_traces(args), 1)
+            print(f"Estimated time for {len(commits)} commits, without the mesa builds: {format_duration(eta * len(commits))}")
+
+        if args.interleave is not None:
+            run_interleaved_commits(args, mesa_directory, commits, base_results_directory)
+            return
+
+        if args.mesa_install_cache is not None:
+            run_cached_commits(args, mesa_directory, commits, base_results_directory)
+            return
+
+        for index, commit, store in commits:
             results_directory = base_results_directory + "-" + str(index) + "-" + commit
-            mesa_directory = os.path.expanduser(args.mesa_directory)
+
             command =  ['git', 'checkout', commit]
             print(command)
 
@@ -204,7 +1199,7 @@ def main():
                 print(f"ERROR building mesa at commit {commit} : {type(err).__name__} was raised: {err}")
                 return
 
-            run_helper(args, results_directory)
+            run_helper(args, results_directory, store, commit)
 
             try:
                 subprocess.run(['git', 'switch', '-'], cwd=mesa_directory, check=True)
@@ -212,8 +1207,6 @@ def main():
                 print(f"ERROR moving back to current mesa branch : {type(err).__name__} was raised: {err}")
                 return
 
-            index = index + 1
-
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,76 @@
+#
+# Snapshots of the mesa on-disk shader cache for run-all-traces.py.
+#
+# The replays of each run use their own shader cache directory (through
+# MESA_SHADER_CACHE_DIR). Once it is warmed up, it is saved as a
+# snapshot keyed by the mesa commit, its build options (with
+# --mesa-install-cache) and the set of traces, so later runs of the
+# same commit and traces can restore it instead of doing the warmup
+# pass again.
+#
+import contextlib
+import hashlib
+import os
+import shutil
+
+# Older mesa versions use MESA_GLSL_CACHE_DIR
+ENV_VARIABLES = ['MESA_SHADER_CACHE_DIR', 'MESA_GLSL_CACHE_DIR']
+
+def get_key(mesa_commit, traces, build_options=''):
+    """Key of the snapshot of mesa_commit (built with build_options) and
+    the traces. The size of each trace is included, so a re-captured
+    trace changes the key."""
+    key = hashlib.sha256((mesa_commit + '\n' + build_options).encode('utf-8'))
+    for trace in sorted(traces, key=os.path.basename):
+        key.update(f"\n{os.path.basename(trace)},{os.path.getsize(trace)}".encode('utf-8'))
+    return key.hexdigest()[:16]
+
+def get_snapshot(snapshot_directory, key):
+    return os.path.join(snapshot_directory, key)
+
+def restore(snapshot_directory, key, directory):
+    """Copies the snapshot to directory. Returns False if there is no
+    snapshot"""
+    snapshot = get_snapshot(snapshot_directory, key)
+    if not os.path.isdir(snapshot):
+        return False
+    clear(directory)
+    shutil.copytree(snapshot, directory, dirs_exist_ok=True)
+    return True
+
+def save(snapshot_directory, key, directory):
+    """Saves directory as the snapshot. The snapshot is only visible
+    once it is complete."""
+    snapshot = get_snapshot(snapshot_directory, key)
+    tmp_snapshot = snapshot + '.tmp'
+    shutil.rmtree(tmp_snapshot, ignore_errors=True)
+    shutil.copytree(directory, tmp_snapshot)
+    shutil.rmtree(snapshot, ignore_errors=True)
+    os.rename(tmp_snapshot, snapshot)
+
+def clear(directory):
+    """Empties directory, keeping it"""
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+@contextlib.contextmanager
+def cache_env(directory):
+    """Points the process environment (so the replays) to the shader
+    cache on directory, restoring it on exit. Nothing is changed if
+    directory is None."""
+    if directory is None:
+        yield
+        return
+    old_env = {name: os.environ.get(name) for name in ENV_VARIABLES}
+    os.environ.update({name: directory for name in ENV_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
@@ -0,0 +1,110 @@
+#
+# Manifest of the traces replayed by run-all-traces.py, with their
+# cached metadata.
+#
+# Each trace file is keyed by its path, size and mtime, and is only
+# hashed again when one of them changes. The metadata of the replays
+# (frame count, replay duration mean and variance) is keyed by the
+# backend and the content hash, so a trace renamed or copied to another
+# directory keeps its history. The manifest is a json file:
+#
+#   {
+#     "files": {path: {"size", "mtime_ns", "backend", "hash"}},
+#     "traces": {"backend:hash": {"frames", "replays", "duration_mean", "duration_m2"}}
+#   }
+#
+import hashlib
+import json
+import math
+import os
+
+READ_SIZE = 1024 * 1024
+
+BACKENDS = {
+    '.gfxr': 'gfxreconstruct',
+    '.trace': 'apitrace',
+}
+
+def get_backend(path):
+    return BACKENDS.get(os.path.splitext(path)[1])
+
+def get_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        while chunk := file_obj.read(READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_id(entry):
+    """Identity of the trace of a file entry"""
+    return f"{entry['backend']}:{entry['hash']}"
+
+class Manifest:
+    """The manifest stored on path, created if it doesn't exist"""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.traces = {}
+        if os.path.exists(path):
+            with open(path) as file_obj:
+                manifest = json.load(file_obj)
+            self.files = manifest['files']
+            self.traces = manifest['traces']
+
+    def save(self):
+        # Written to a temporary file first, so an interrupted run never
+        # leaves a half-written manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file_obj:
+            json.dump({'files': self.files, 'traces': self.traces}, file_obj)
+        os.replace(tmp_path, self.path)
+
+    def get_file(self, path):
+        """Returns the entry of the trace file, hashing it if it is new or
+        it changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'backend': get_backend(path),
+                'hash': get_hash(path),
+            }
+            self.files[path] = entry
+            self.save()
+        return entry
+
+    def get_trace(self, path):
+        """Returns the replay metadata of the trace, or None if it was
+        never replayed"""
+        return self.traces.get(get_id(self.get_file(path)))
+
+    def add_replay(self, path, duration, frames=None):
+        trace = self.traces.setdefault(get_id(self.get_file(path)), {
+            'frames': None,
+            'replays': 0,
+            'duration_mean': 0.0,
+            'duration_m2': 0.0,
+        })
+        if frames:
+            trace['frames'] = frames
+        # Welford's online mean and variance
+        trace['replays'] += 1
+        delta = duration - trace['duration_mean']
+        trace['duration_mean'] += delta / trace['replays']
+        trace['duration_m2'] += delta * (duration - trace['duration_mean'])
+        self.save()
+
+    def get_duration(self, path):
+        """Returns the (mean, standard deviation) of the replay duration of
+        the trace, or None if it was never replayed"""
+        trace = self.get_trace(path)
+        if trace is None or trace['replays'] == 0:
+            return None
+        std_deviation = 0.0
+        if trace['replays'] > 1:
+            std_deviation = math.sqrt(trace['duration_m2'] / (trace['replays'] - 1))
+        return trace['duration_mean'], std_deviation
@@ -0,0 +1,118 @@
+#
+# Trace staging for run-all-traces.py, so the replays don't pay for
+# reading the traces from slow (ie: network) storage.
+#
+# The traces are copied (reflinked when possible) to a fast local
+# directory (ie: a tmpfs), or, without a directory, just read once so
+# they are on the page cache. This is done on a background thread, for
+# the next traces while the current one is replayed, as long as they
+# fit on the memory budget. Once a trace is measured it is evicted.
+#
+import concurrent.futures
+import os
+import shutil
+import subprocess
+
+READ_SIZE = 1024 * 1024
+
+def prefetch(path):
+    """Reads the whole file, so it is on the page cache"""
+    with open(path, 'rb') as file_obj:
+        fd = file_obj.fileno()
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        buffer = bytearray(READ_SIZE)
+        while file_obj.readinto(buffer):
+            pass
+
+def evict(path):
+    """Drops the file from the page cache"""
+    with open(path, 'rb') as file_obj:
+        os.posix_fadvise(file_obj.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def copy(path, stage_directory):
+    staged_path = os.path.join(stage_directory, os.path.basename(path))
+    if shutil.which('cp') is not None:
+        subprocess.run(['cp', '--reflink=auto', path, staged_path], check=True)
+    else:
+        shutil.copyfile(path, staged_path)
+    return staged_path
+
+class TraceStager:
+    """Stages the traces on a background thread. stage_directory can be
+    None to only prefetch them on the page cache."""
+
+    def __init__(self, stage_directory, budget):
+        self.stage_directory = stage_directory
+        self.budget = budget
+        self.size = 0
+        self.staged = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def stage(self, path):
+        """Starts staging the trace, returns False if it doesn't fit on
+        the budget. A trace bigger than the whole budget is staged
+        anyway if nothing else is."""
+        if path in self.staged:
+            return True
+        size = os.path.getsize(path)
+        if self.size + size > self.budget and self.size > 0:
+            return False
+        self.size += size
+        if self.stage_directory is None:
+            self.staged[path] = (self.executor.submit(prefetch, path), size)
+        else:
+            self.staged[path] = (self.executor.submit(copy, path, self.stage_directory), size)
+        return True
+
+    def get(self, path):
+        """Returns the path the trace should be replayed from, waiting
+        for its staging. If the staging failed it is the original path."""
+        self.stage(path)
+        future, size = self.staged[path]
+        try:
+            staged_path = future.result()
+        except Exception as err:
+            print(f"ERROR staging trace {path} : {type(err).__name__} was raised: {err}")
+            return path
+        return staged_path if staged_path is not None else path
+
+    def release(self, path):
+        if path not in self.staged:
+            return
+        future, size = self.staged.pop(path)
+        self.size -= size
+        try:
+            staged_path = future.result()
+            if staged_path is None:
+                evict(path)
+            else:
+                os.remove(staged_path)
+        except Exception:
+            pass
+
+    def close(self):
+        for path in list(self.staged):
+            self.release(path)
+        self.executor.shutdown()
+
+def staged(traces, stage_directory, budget, should_stage=None):
+    """Yields each trace with the path it should be replayed from,
+    staging the next ones while the caller replays the current one.
+    Only the traces for which should_stage returns True are staged."""
+    stage_traces = [path for path in traces if should_stage is None or should_stage(path)]
+    next_trace = 0
+    stager = TraceStager(stage_directory, budget)
+    try:
+        for path in traces:
+            if next_trace >= len(stage_traces) or stage_traces[next_trace] != path:
+                yield path, path
+                continue
+            next_trace += 1
+            staged_path = stager.get(path)
+            for next_path in stage_traces[next_trace:]:
+                if not stager.stage(next_path):
+                    break
+            yield path, staged_path
+            stager.release(path)
+    finally:
+        stager.close()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+#
+# Compares piglit results (the piglit, VK-CTS, GL-CTS and dEQP GLES runs
+# of full-piglit-run.sh) with their references, printing only the tests
+# whose status changed. Unlike "piglit summary console -d", the results
+# json is never loaded whole, so it is fast and light with the full
+# VK-CTS results.
+#
+# The results json (results.json, or compressed as .gz, .bz2 or .xz) is
+# parsed one test at a time, and reduced to a table with the sorted test
+# names and a status byte per test. The table is cached next to the
+# json (results.status), and rebuilt when the json changes, so the
+# reference is only parsed once.
+#
+# Several reference/results pairs (ie: the five suites of a nightly
+# run) are compared in parallel:
+#
+#   compare-piglit-results.py <reference> <results> [<reference> <results>...]
+#
+import argparse
+import bz2
+import concurrent.futures
+import gzip
+import json
+import lzma
+import os
+import re
+import struct
+
+OPENERS = [
+    ('results.json', open),
+    ('results.json.gz', gzip.open),
+    ('results.json.bz2', bz2.open),
+    ('results.json.xz', lzma.open),
+]
+
+TABLE_FILENAME = 'results.status'
+TABLE_MAGIC = b'PIGSTAT1'
+# magic, json size, json mtime, number of tests, size of the status
+# table, size of the names blob
+TABLE_HEADER = struct.Struct('<8sQqQQQ')
+
+READ_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+# From better to worse, as piglit does. Other statuses (skip, notrun)
+# are not ordered, so changes from or to them are neither regressions
+# nor fixes.
+SEVERITY = ['pass', 'dmesg-warn', 'warn', 'dmesg-fail', 'fail', 'crash', 'timeout', 'incomplete']
+
+def find_results_json(results):
+    """Returns the results json of a results directory (or the json
+    itself) and the function to open it"""
+    if os.path.isfile(results):
+        for filename, opener in OPENERS:
+            if results.endswith(filename[len('results'):]):
+                return results, opener
+        return results, open
+    for filename, opener in OPENERS:
+        path = os.path.join(results, filename)
+        if os.path.exists(path):
+            return path, opener
+    raise FileNotFoundError(f"No results.json found on {results}")
+
+class JsonStream:
+    """Decodes the values of a json document one at a time, reading it
+    in chunks"""
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.file_obj.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of the json document")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at json offset {self.pos}")
+        self.pos += 1
+
+    def skip_comma(self):
+        """Returns True if there is a comma (so another member)"""
+        if self.peek() == ',':
+            self.pos += 1
+            return True
+        return False
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue on the
+                # next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def iter_statuses(stream):
+    """Yields (test, status) of the tests of a piglit results json.
+    Subtests are yielded as test@subtest."""
+    stream.expect('{')
+    while stream.peek() != '}':
+        key = stream.decode()
+        stream.expect(':')
+        if key != 'tests':
+            stream.decode()
+        else:
+            stream.expect('{')
+            while stream.peek() != '}':
+                name = stream.decode()
+                stream.expect(':')
+                test = stream.decode()
+                yield name, test.get('result', 'notrun')
+                for subtest, status in (test.get('subtests') or {}).items():
+                    yield f"{name}@{subtest}", status
+                if not stream.skip_comma():
+                    break
+            stream.expect('}')
+        if not stream.skip_comma():
+            break
+
+def build_table(json_filename, opener):
+    """Returns (names, statuses, status bytes) of the results json, with
+    the names sorted"""
+    with opener(json_filename, 'rt', encoding='utf-8') as file_obj:
+        tests = dict(iter_statuses(JsonStream(file_obj)))
+    statuses = sorted(set(tests.values()))
+    status_index = {status: i for i, status in enumerate(statuses)}
+    names = sorted(tests)
+    return names, statuses, bytes(status_index[tests[name]] for name in names)
+
+def write_table(table_filename, stat, names, statuses, status_bytes):
+    statuses_blob = '\n'.join(statuses).encode('utf-8')
+    names_blob = '\n'.join(names).encode('utf-8')
+    tmp_filename = table_filename + '.tmp'
+    with open(tmp_filename, 'wb') as file_obj:
+        file_obj.write(TABLE_HEADER.pack(TABLE_MAGIC, stat.st_size, stat.st_mtime_ns, len(names),
+                                         len(statuses_blob), len(names_blob)))
+        file_obj.write(statuses_blob)
+        file_obj.write(names_blob)
+        file_obj.write(status_bytes)
+    os.replace(tmp_filename, table_filename)
+
+def read_table(table_filename, stat):
+    """Returns the cached table, or None if it is missing or stale"""
+    try:
+        with open(table_filename, 'rb') as file_obj:
+            data = file_obj.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < TABLE_HEADER.size:
+        return None
+    magic, size, mtime_ns, count, statuses_len, names_len = TABLE_HEADER.unpack_from(data)
+    if magic != TABLE_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+        return None
+    offset = TABLE_HEADER.size
+    statuses = data[offset:offset + statuses_len].decode('utf-8').split('\n')
+    offset += statuses_len
+    names = data[offset:offset + names_len].decode('utf-8').split('\n') if count else []
+    offset += names_len
+    return names, statuses, data[offset:offset + count]
+
+def load_table(results):
+    json_filename, opener = find_results_json(results)
+    stat = os.stat(json_filename)
+    table_filename = os.path.join(os.path.dirname(json_filename), TABLE_FILENAME)
+    table = read_table(table_filename, stat)
+    if table is None:
+        table = build_table(json_filename, opener)
+        try:
+            write_table(table_filename, stat, *table)
+        except OSError:
+            # ie: a read-only results directory. It just isn't cached
+            pass
+    return table
+
+def classify(before, after):
+    if before in SEVERITY and after in SEVERITY:
+        return 'regression' if SEVERITY.index(after) > SEVERITY.index(before) else 'fix'
+    return 'change'
+
+def compare(reference, results):
+    """Returns the (kind, test, before, after) of the tests whose status
+    changed. Tests only on one of them are notrun on the other."""
+    ref_names, ref_statuses, ref_bytes = load_table(reference)
+    names, statuses, status_bytes = load_table(results)
+
+    # Same tests, same status tables: nothing to walk
+    if ref_names == names and ref_statuses == statuses and ref_bytes == status_bytes:
+        return []
+
+    changes = []
+    i = j = 0
+    while i < len(ref_names) or j < len(names):
+        if j >= len(names) or (i < len(ref_names) and ref_names[i] < names[j]):
+            test, before, after = ref_names[i], ref_statuses[ref_bytes[i]], 'notrun'
+            i += 1
+        elif i >= len(ref_names) or names[j] < ref_names[i]:
+            test, before, after = names[j], 'notrun', statuses[status_bytes[j]]
+            j += 1
+        else:
+            test, before, after = names[j], ref_statuses[ref_bytes[i]], statuses[status_bytes[j]]
+            i += 1
+            j += 1
+        if before != after:
+            changes.append((classify(before, after), test, before, after))
+    return changes
+
+def run_compare(reference, results):
+    try:
+        return compare(reference, results), None
+    except Exception as err:
+        return None, f"{type(err).__name__} was raised: {err}"
+
+def print_changes(reference, results, changes):
+    print(f"** {os.path.basename(os.path.normpath(results))} (reference {reference}) **")
+    counts = {'regression': 0, 'fix': 0, 'change': 0}
+    for kind, test, before, after in changes:
+        print(f"{kind}: {test}: {before} -> {after}")
+        counts[kind] += 1
+    print(f"regressions: {counts['regression']}")
+    print(f"fixes: {counts['fix']}")
+    print(f"changes: {counts['change']}")
+    print("")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("results", nargs='+', help="Pairs of reference and results directories (or results json files)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of pairs compared in parallel (default: number of cpus)")
+
+    args = parser.parse_args()
+
+    if len(args.results) % 2 != 0:
+        print("Error - the results have to be pairs of reference and results")
+        return
+
+    pairs = list(zip(args.results[0::2], args.results[1::2]))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        outcomes = list(executor.map(run_compare, *zip(*pairs)))
+
+    for (reference, results), (changes, error) in zip(pairs, outcomes):
+        if error is not None:
+            print(f"ERROR comparing {results} with {reference} : {error}")
+            continue
+        print_changes(reference, results, changes)
+
+if __name__ == "__main__":
+    main()
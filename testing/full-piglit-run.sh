@@ -186,41 +186,75 @@ function inner_run_tests {
 	return 9
     fi
     if $FPR_CREATE_PIGLIT_REPORT; then
-	printf "%s\n" "" "$FPR_PIGLIT_PATH/piglit summary console -d $FPR_INNER_RUN_REFERENCE $FPR_INNER_RUN_RESULTS" ""
-	FPR_INNER_SUMMARY=$("$FPR_PIGLIT_PATH"/piglit summary console -d "$FPR_INNER_RUN_REFERENCE" "$FPR_INNER_RUN_RESULTS")
-	if [ $? -ne 0 ]; then
-	    return 10
-	fi
-	read -ra FPR_INNER_RESULTS <<< $(echo "$FPR_INNER_SUMMARY" | $FPR_GREP ^regressions)
-	if [ "x${FPR_INNER_RESULTS[2]}" != "x0" ]; then
+	# The results of all the suites are compared at once, once
+	# they are all run
+	FPR_COMPARE_NAMES+=("$FPR_INNER_RUN_NAME")
+	FPR_COMPARE_PAIRS+=("$FPR_INNER_RUN_REFERENCE" "$FPR_INNER_RUN_RESULTS")
+	FPR_COMPARE_SUMMARIES+=("$FPR_INNER_RUN_SUMMARY")
+    else
+	printf "%s\n" \
+	       "" \
+	       "Results created for run: $FPR_INNER_RUN_NAME" \
+	       "" >&9
+    fi
+
+    return 0
+}
+
+#------------------------------------------------------------------------------
+#			Function: compare_results
+#------------------------------------------------------------------------------
+#
+# compares the results of all the runs with their references with a
+# single compare-piglit-results.py invocation, that compares the pairs
+# in parallel. Only the status changes are printed, the results json
+# is parsed incrementally, much lighter than "piglit summary console
+# -d" on the full VK-CTS results
+# returns:
+#   0 is success, an error code otherwise
+function compare_results {
+    test ${#FPR_COMPARE_NAMES[@]} -eq 0 && return 0
+    FPR_COMPARE="$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/compare-piglit-results.py"
+    printf "%s\n" "" "$FPR_COMPARE ${FPR_COMPARE_PAIRS[*]}" ""
+    FPR_COMPARE_OUTPUT=$(python3 "$FPR_COMPARE" "${FPR_COMPARE_PAIRS[@]}")
+    if [ $? -ne 0 ] || echo "$FPR_COMPARE_OUTPUT" | $FPR_GREP -q ^ERROR; then
+	echo "$FPR_COMPARE_OUTPUT" | $FPR_GREP ^ERROR >&2
+	return 10
+    fi
+
+    for i in "${!FPR_COMPARE_NAMES[@]}"; do
+	FPR_COMPARE_NAME="${FPR_COMPARE_NAMES[$i]}"
+	FPR_COMPARE_REFERENCE="${FPR_COMPARE_PAIRS[$((2 * i))]}"
+	FPR_COMPARE_RESULTS="${FPR_COMPARE_PAIRS[$((2 * i + 1))]}"
+	# Each pair has its own section, from its "** <run name>" header
+	# to the next blank line
+	FPR_COMPARE_SUMMARY=$(echo "$FPR_COMPARE_OUTPUT" | awk -v header="** $FPR_COMPARE_NAME (reference " \
+							  'index($0, header) == 1 { p = 1 } p && $0 == "" { exit } p { print }')
+	read -ra FPR_COMPARE_REGRESSIONS <<< $(echo "$FPR_COMPARE_SUMMARY" | $FPR_GREP ^regressions:)
+	if [ "x${FPR_COMPARE_REGRESSIONS[1]}" != "x0" ]; then
 	    printf "%s\n" \
 		   "" \
-		   "Run name: $FPR_INNER_RUN_NAME" \
+		   "Run name: $FPR_COMPARE_NAME" \
 		   "" \
-		   "$FPR_INNER_SUMMARY" \
+		   "$FPR_COMPARE_SUMMARY" \
 		   "" \
-		   "Regressions: ${FPR_INNER_RESULTS[2]}" \
+		   "Regressions: ${FPR_COMPARE_REGRESSIONS[1]}" \
 		   "" >&9
 	    printf "%s\n" \
 		   "" \
-		   "${FPR_PIGLIT_PATH}/piglit summary html -o -e pass $FPR_INNER_RUN_SUMMARY $FPR_INNER_RUN_REFERENCE $FPR_INNER_RUN_RESULTS" \
+		   "${FPR_PIGLIT_PATH}/piglit summary html -o -e pass ${FPR_COMPARE_SUMMARIES[$i]} $FPR_COMPARE_REFERENCE $FPR_COMPARE_RESULTS" \
 		   ""
-	    "${FPR_PIGLIT_PATH}"/piglit summary html -o -e pass "$FPR_INNER_RUN_SUMMARY" "$FPR_INNER_RUN_REFERENCE" "$FPR_INNER_RUN_RESULTS"
+	    "${FPR_PIGLIT_PATH}"/piglit summary html -o -e pass "${FPR_COMPARE_SUMMARIES[$i]}" "$FPR_COMPARE_REFERENCE" "$FPR_COMPARE_RESULTS"
 	    if [ $? -ne 0 ]; then
 		return 11
 	    fi
 	else
 	    printf "%s\n" \
 		   "" \
-		   "No regressions detected in run: $FPR_INNER_RUN_NAME" \
+		   "No regressions detected in run: $FPR_COMPARE_NAME" \
 		   "" >&9
 	fi
-    else
-	printf "%s\n" \
-	       "" \
-	       "Results created for run: $FPR_INNER_RUN_NAME" \
-	       "" >&9
-    fi
+    done
 
     return 0
 }
@@ -286,6 +320,10 @@ function run_tests {
 
     TIMESTAMP=`date +%Y%m%d%H%M%S`
 
+    FPR_COMPARE_NAMES=()
+    FPR_COMPARE_PAIRS=()
+    FPR_COMPARE_SUMMARIES=()
+
     VK_CTS_NAME="${FPR_VK_CTS_PREFIX}-${FPR_GL_DRIVER}-${TIMESTAMP}-${VK_GL_CTS_COMMIT}-mesa-${FPR_MESA_COMMIT}"
     GL_CTS_NAME="${FPR_GL_CTS_PREFIX}-${FPR_GL_DRIVER}-${TIMESTAMP}-${VK_GL_CTS_COMMIT}-mesa-${FPR_MESA_COMMIT}"
     DEQP_GLES2_NAME="${FPR_DEQP_GLES2_PREFIX}-${FPR_GL_DRIVER}-${TIMESTAMP}-${DEQP_COMMIT}-mesa-${FPR_MESA_COMMIT}"
@@ -462,6 +500,8 @@ function run_tests {
 	    return $?
 	fi
     fi
+
+    compare_results
 }
 
 #------------------------------------------------------------------------------